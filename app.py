@@ -1,9 +1,10 @@
-import locale
 import math
 import os
+import re
 import secrets
-from collections.abc import Mapping, Sequence
+from collections.abc import Sequence
 import time
+from datetime import datetime
 from typing import cast
 
 import markupsafe
@@ -21,9 +22,12 @@ from werkzeug.wrappers import Response
 
 import add_book
 import author
+import cache
 import checks
+import classification
 import db
 import env
+import etag
 import library
 import users
 
@@ -31,32 +35,175 @@ env.read_env_file()
 
 app = Flask(__name__)
 app.secret_key = os.environ["SECRET_KEY"]
+db.init_app(app)
+cache.configure()
+app.jinja_env.add_extension(cache.FragmentCacheExtension)
+if db.check_settings():
+    # Load the classification up front so that the first requests don't
+    # have to wait for it.
+    _ = classification.get_index()
 
 context = {"site": {"subtitle": "Kirjat purkissa", "title": "Flask-kirjasto"}}
 
+# The number of reviews shown at once on the book page.
+REVIEWS_PAGE_SIZE = 20
+
 
 @app.before_request
 def before_request():
     g.start_time = time.time()
+    # The pages that haven't changed since the client loaded them are
+    # answered before any of the queries of the page run.
+    return etag.check_request()
+
+
+# The Server-Timing header only has the time used by the database and by
+# the rest of the app by default, as the statements shouldn't be shown to
+# every client. The statements and the cache hits are listed when the app
+# is run in debug mode or SERVER_TIMING_QUERIES is set.
+SERVER_TIMING_QUERIES = os.environ.get(
+    "SERVER_TIMING_QUERIES", "0"
+).lower() in ("1", "true", "yes")
+
+# The maximum number of single statements listed in the Server-Timing
+# header. The rest are only included in the total database time.
+SERVER_TIMING_MAX_QUERIES = 30
 
 
 @app.after_request
 def after_request(response: Response):
-    elapsed_time: float = round(time.time() - cast(float, g.start_time), 2)
-    print("elapsed time:", elapsed_time, "s")
-    return response
+    elapsed = time.time() - cast(float, g.start_time)
+    elapsed_time: float = round(elapsed, 2)
+    stats = db.get_query_stats()
+    db_time = sum(q.duration_ms for q in stats)
+    print(
+        "elapsed time:",
+        elapsed_time,
+        "s,",
+        len(stats),
+        "queries in",
+        round(db_time, 1),
+        "ms",
+    )
+    response.headers["Server-Timing"] = server_timing(
+        elapsed * 1000,
+        db_time,
+        stats,
+        cache.get_request_stats(),
+        SERVER_TIMING_QUERIES or app.debug,
+    )
+    return etag.add_etag(response)
+
+
+def server_timing(
+    total_ms: float,
+    db_ms: float,
+    stats: Sequence[db.QueryStat],
+    cache_stats: cache.Stats,
+    queries: bool = False,
+) -> str:
+    """
+    Builds the Server-Timing header value that splits the time used by
+    the request between the database and the rest of the app. If
+    `queries` is set, the time is also broken down to the database
+    statements and the hits and the misses of the result cache are
+    included.
+    """
+
+    def desc(text: str) -> str:
+        # The header must be plain ASCII and the description a valid
+        # quoted string.
+        text = text.encode("ascii", "replace").decode("ascii")
+        text = text.replace("\\", "").replace('"', "'")
+        # The tables tell the statements apart better than the columns,
+        # so the column list of a query is left out. The FROM clauses of
+        # the subqueries in the column list are skipped.
+        if text.startswith("SELECT "):
+            depth = 0
+            for m in re.finditer(r"[()]| FROM ", text):
+                if m[0] == "(":
+                    depth += 1
+                elif m[0] == ")":
+                    depth -= 1
+                elif depth == 0:
+                    text = "SELECT ..." + text[m.start() :]
+                    break
+        return text if len(text) <= 80 else text[:77] + "..."
+
+    metrics = [f"db;dur={db_ms:.1f}", f"app;dur={total_ms - db_ms:.1f}"]
+    if not queries:
+        return ", ".join(metrics)
+    metrics[0] += f';desc="{len(stats)} queries"'
+    metrics.append(
+        f'cache;desc="{cache_stats.hits} hits, {cache_stats.misses} misses"'
+    )
+    for i, q in enumerate(stats[:SERVER_TIMING_MAX_QUERIES], 1):
+        text = f"{q.rows} rows: {desc(q.sql)}"
+        metrics.append(f'q{i};dur={q.duration_ms:.2f};desc="{text}"')
+    return ", ".join(metrics)
+
+
+def get_page_cursor() -> tuple[str | None, bool]:
+    """
+    Returns the pagination cursor of the current request and whether
+    the listing should be read backwards from it.
+    """
+    before = request.args.get("before")
+    if before:
+        return before, True
+    return request.args.get("after") or None, False
+
+
+def pagination_url(
+    path: str, cursor_name: str, cursor: str | None, query: str
+) -> str:
+    """
+    Builds the URL for a neighbouring page of a paginated listing. If a
+    cursor is given, the page is fetched using it so that the database
+    can seek directly to it instead of skipping all of the rows before
+    the page.
+    """
+    args: list[str] = []
+    if cursor:
+        args.append(f"{cursor_name}={cursor}")
+    if query:
+        args.append(query)
+    return path + ("?" + "&".join(args) if args else "")
+
+
+# The tables that the book listings are built from.
+LISTING_TABLES = ("authors", "books", "book_ownerships")
+
+
+def viewer_version() -> int:
+    """
+    Returns the version of the books of the user that is logged in. The
+    listings mark the books that the user owns and has read.
+    """
+    user_id = cast(int | None, session.get("user_id"))
+    return library.get_user_version(user_id) if user_id is not None else 0
+
+
+def user_page_versions(username: str) -> list[int] | None:
+    version = library.get_user_version_by_name(username)
+    if version is None:
+        return None
+    return [version, *cache.get_versions(LISTING_TABLES), viewer_version()]
 
 
 @app.route("/", methods=["GET"])
+@etag.versioned(
+    lambda: [*cache.get_versions(LISTING_TABLES), viewer_version()]
+)
 def index() -> str:
     books = library.get_popular_books(10)
-    owned: Sequence[library.BookIDCounts] = []
-    read_books: Sequence[library.JointBook] = []
+    owned: dict[int, int] = {}
+    read_books: set[int] = set()
     if "user_id" in session:
-        owned = library.get_owned_book_counts_by_id(
-            cast(int, session["user_id"])
-        )
-        read_books = library.get_read_books(cast(int, session["user_id"]))
+        user_id = cast(int, session["user_id"])
+        book_ids = [b.id for b in books]
+        owned = library.get_owned_counts_for_books(user_id, book_ids)
+        read_books = library.get_read_book_ids(user_id, book_ids)
     return render_template(
         "index.html",
         books=books,
@@ -76,6 +223,7 @@ def index() -> str:
     "/kayttaja/<string:username>/", defaults={"page": None}, methods=["GET"]
 )
 @app.route("/kayttaja/<string:username>/<int:page>/", methods=["GET"])
+@etag.versioned(lambda username, page: user_page_versions(username))
 def user_page(username: str, page: int | None):
     user = users.get_users_by_name(username)
     if not user:
@@ -90,12 +238,9 @@ def user_page(username: str, page: int | None):
 
     page_count = math.ceil(book_count / page_size) if book_count > 0 else 1
 
-    add_per_page_param = False
-
     params: str = ""
     if per_page:
         params = f"?per_page={per_page}"
-        add_per_page_param = True
 
     if (page and page <= 1) or "reset_page" in request.args:
         # I want the default URL to be clean.
@@ -109,12 +254,38 @@ def user_page(username: str, page: int | None):
     if page > page_count:
         return redirect(f"/kayttaja/{username}/{page_count}{params}")
 
-    books = library.get_owned_books_paginated(user.id, page, page_size)
-    owned: Sequence[library.BookIDCounts] = []
-    owned = library.get_owned_book_counts_by_id(user.id)
-    read_books: Sequence[library.JointBook] = []
+    cursor, backwards = get_page_cursor()
+    result = library.get_owned_books_paginated(
+        user.id, page, page_size, cursor, backwards
+    )
+    query = params[1:]
+    prev_url = (
+        pagination_url(
+            f"/kayttaja/{username}/{page - 1}/",
+            "before",
+            result.prev_cursor,
+            query,
+        )
+        if page > 1
+        else None
+    )
+    next_url = (
+        pagination_url(
+            f"/kayttaja/{username}/{page + 1}/",
+            "after",
+            result.next_cursor,
+            query,
+        )
+        if page < page_count and result.next_cursor
+        else None
+    )
+    book_ids = [b.id for b in result.books]
+    owned = library.get_owned_counts_for_books(user.id, book_ids)
+    read_books: set[int] = set()
     if "user_id" in session:
-        read_books = library.get_read_books(cast(int, session["user_id"]))
+        read_books = library.get_read_book_ids(
+            cast(int, session["user_id"]), book_ids
+        )
 
     grand_total = library.get_user_grand_total_books(user.id)
 
@@ -122,11 +293,12 @@ def user_page(username: str, page: int | None):
         "user.html",
         user=user,
         grand_total=grand_total,
-        books=books,
+        books=result.books,
         page=page,
         page_count=page_count,
+        prev_url=prev_url,
+        next_url=next_url,
         page_size=page_size,
-        add_per_page_param=add_per_page_param,
         owned=owned,
         read_books=read_books,
         **context,
@@ -139,6 +311,7 @@ def user_page(username: str, page: int | None):
     methods=["GET"],
 )
 @app.route("/kayttaja/<string:username>/luetut/<int:page>/", methods=["GET"])
+@etag.versioned(lambda username, page: user_page_versions(username))
 def user_read_page(username: str, page: int | None):
     user = users.get_users_by_name(username)
     if not user:
@@ -152,12 +325,9 @@ def user_read_page(username: str, page: int | None):
 
     page_count = math.ceil(book_count / page_size) if book_count > 0 else 1
 
-    add_per_page_param = False
-
     params: str = ""
     if per_page:
         params = f"?per_page={per_page}"
-        add_per_page_param = True
 
     if (page and page <= 1) or "reset_page" in request.args:
         # I want the default URL to be clean.
@@ -171,22 +341,49 @@ def user_read_page(username: str, page: int | None):
     if page > page_count:
         return redirect(f"/kayttaja/{username}/luetut/{page_count}{params}")
 
-    books = library.get_read_books_paginated(user.id, page, page_size)
-    owned: Sequence[library.BookIDCounts] = []
-    owned = library.get_owned_book_counts_by_id(user.id)
-    read_books: Sequence[library.JointBook] = []
+    cursor, backwards = get_page_cursor()
+    result = library.get_read_books_paginated(
+        user.id, page, page_size, cursor, backwards
+    )
+    query = params[1:]
+    prev_url = (
+        pagination_url(
+            f"/kayttaja/{username}/luetut/{page - 1}/",
+            "before",
+            result.prev_cursor,
+            query,
+        )
+        if page > 1
+        else None
+    )
+    next_url = (
+        pagination_url(
+            f"/kayttaja/{username}/luetut/{page + 1}/",
+            "after",
+            result.next_cursor,
+            query,
+        )
+        if page < page_count and result.next_cursor
+        else None
+    )
+    book_ids = [b.id for b in result.books]
+    owned = library.get_owned_counts_for_books(user.id, book_ids)
+    read_books: set[int] = set()
     if "user_id" in session:
-        read_books = library.get_read_books(cast(int, session["user_id"]))
+        read_books = library.get_read_book_ids(
+            cast(int, session["user_id"]), book_ids
+        )
 
     return render_template(
         "user_read.html",
         user=user,
         grand_total=book_count,
-        books=books,
+        books=result.books,
         page=page,
         page_count=page_count,
+        prev_url=prev_url,
+        next_url=next_url,
         page_size=page_size,
-        add_per_page_param=add_per_page_param,
         owned=owned,
         read_books=read_books,
         **context,
@@ -430,6 +627,9 @@ def logout() -> Response:
 
 @app.route("/kirjasto/", defaults={"page": None}, methods=["GET"])
 @app.route("/kirjasto/<int:page>/", methods=["GET"])
+@etag.versioned(
+    lambda page: [*cache.get_versions(LISTING_TABLES), viewer_version()]
+)
 def library_page(page: int | None):
     per_page = request.args.get("per_page")
     book_count = library.get_book_count()
@@ -441,12 +641,9 @@ def library_page(page: int | None):
     # no books.
     page_count = math.ceil(book_count / page_size) if book_count > 0 else 1
 
-    add_per_page_param = False
-
     params: str = ""
     if per_page:
         params = f"?per_page={per_page}"
-        add_per_page_param = True
 
     if (page and page <= 1) or "reset_page" in request.args:
         # I want the default URL to be clean.
@@ -460,24 +657,42 @@ def library_page(page: int | None):
     if page > page_count:
         return redirect(f"/kirjasto/{page_count}{params}")
 
-    books = library.get_books(page, page_size)
-    owned: Sequence[library.BookIDCounts] = []
-    read_books: Sequence[library.JointBook] = []
-    if "user_id" in session:
-        owned = library.get_owned_book_counts_by_id(
-            cast(int, session["user_id"])
+    cursor, backwards = get_page_cursor()
+    result = library.get_books(page, page_size, cursor, backwards)
+    query = params[1:]
+    prev_url = (
+        pagination_url(
+            f"/kirjasto/{page - 1}/", "before", result.prev_cursor, query
         )
-        read_books = library.get_read_books(cast(int, session["user_id"]))
+        if page > 1
+        else None
+    )
+    next_url = (
+        pagination_url(
+            f"/kirjasto/{page + 1}/", "after", result.next_cursor, query
+        )
+        if page < page_count and result.next_cursor
+        else None
+    )
+    owned: dict[int, int] = {}
+    read_books: set[int] = set()
+    if "user_id" in session:
+        user_id = cast(int, session["user_id"])
+        book_ids = [b.id for b in result.books]
+        owned = library.get_owned_counts_for_books(user_id, book_ids)
+        read_books = library.get_read_book_ids(user_id, book_ids)
 
     return render_template(
         "library.html",
-        books=books,
+        books=result.books,
         page=page,
         page_count=page_count,
+        prev_url=prev_url,
+        next_url=next_url,
         page_size=page_size,
-        add_per_page_param=add_per_page_param,
         owned=owned,
         read_books=read_books,
+        listing_version=cache.get_versions(LISTING_TABLES),
         **context,
     )
 
@@ -497,6 +712,7 @@ def library_search(page: int | None):
         author = str(request.args.get("author"))
     if request.args.get("classification"):
         classification = str(request.args.get("classification"))
+    ranked = request.args.get("order") == "rank"
 
     # NOTE: We want to keep the state of the search in the URL, but with
     # a new post, override the URL parameters.
@@ -511,21 +727,27 @@ def library_search(page: int | None):
             classification = request.form["classification"]
 
     per_page = request.args.get("per_page")
-    book_count = library.search_result_count(
-        isbn=isbn, name=name, author=author, classification=classification
-    )
     page_size = 10
     if per_page:
         page_size = int(per_page)
 
-    page_count = math.ceil(book_count / page_size) if book_count > 0 else 1
-
-    add_per_page_param = False
+    # The results are counted only as far as the requested page, so a
+    # broad search shows that there are more results instead of the
+    # exact count.
+    book_count = library.search_result_count(
+        isbn=isbn,
+        name=name,
+        author=author,
+        classification=classification,
+        limit=library.search_count_limit(page or 1, page_size),
+    )
+    page_count = (
+        math.ceil(book_count.count / page_size) if book_count.count > 0 else 1
+    )
 
     params: str = ""
     if per_page:
         params = f"?per_page={per_page}"
-        add_per_page_param = True
 
     if isbn:
         params += f"&isbn={isbn}" if params else f"?isbn={isbn}"
@@ -540,6 +762,14 @@ def library_search(page: int | None):
             else f"?classification={classification}"
         )
 
+    # The link for switching the order of the results keeps the search
+    # but starts from the first page.
+    order_url = f"/kirjasto/haku{params}"
+    if not ranked:
+        order_url += "&order=rank" if params else "?order=rank"
+    else:
+        params += "&order=rank" if params else "?order=rank"
+
     if (page and page <= 1) or "reset_page" in request.args:
         # I want the default URL to be clean.
         return redirect(f"/kirjasto/haku{params}")
@@ -555,24 +785,50 @@ def library_search(page: int | None):
     if request.method == "POST":
         return redirect(f"/kirjasto/haku{params}")
 
-    books = library.search(
+    cursor, backwards = get_page_cursor()
+    result = library.search(
         page=page,
         page_size=page_size,
         isbn=isbn,
         name=name,
         author=author,
         classification=classification,
+        cursor=cursor,
+        backwards=backwards,
+        ranked=ranked,
     )
 
-    owned: Sequence[library.BookIDCounts] = []
-    read_books: Sequence[library.JointBook] = []
+    owned: dict[int, int] = {}
+    read_books: set[int] = set()
     if "user_id" in session:
-        owned = library.get_owned_book_counts_by_id(
-            cast(int, session["user_id"])
-        )
-        read_books = library.get_read_books(cast(int, session["user_id"]))
+        user_id = cast(int, session["user_id"])
+        book_ids = [b.id for b in result.books]
+        owned = library.get_owned_counts_for_books(user_id, book_ids)
+        read_books = library.get_read_book_ids(user_id, book_ids)
 
     search_params = params[1:]
+    prev_url = (
+        pagination_url(
+            f"/kirjasto/haku/{page - 1}/",
+            "before",
+            result.prev_cursor,
+            search_params,
+        )
+        if page > 1
+        else None
+    )
+    next_url = (
+        pagination_url(
+            f"/kirjasto/haku/{page + 1}/",
+            "after",
+            result.next_cursor,
+            search_params,
+        )
+        # The ranked results are paginated by the page number.
+        if (page < page_count or not book_count.exact)
+        and (result.next_cursor or ranked)
+        else None
+    )
 
     form_data = {
         "isbn": isbn,
@@ -583,15 +839,133 @@ def library_search(page: int | None):
 
     return render_template(
         "library_search.html",
-        books=books,
+        books=result.books,
         page=page,
         page_count=page_count,
+        page_count_exact=book_count.exact,
+        prev_url=prev_url,
+        next_url=next_url,
         page_size=page_size,
-        add_per_page_param=add_per_page_param,
         owned=owned,
         search_params=search_params,
+        ranked=ranked,
+        order_url=order_url,
         form_data=form_data,
         read_books=read_books,
+        listing_version=cache.get_versions(LISTING_TABLES),
+        **context,
+    )
+
+
+@app.route(
+    "/kirjasto/luokitus/",
+    defaults={"key": None, "page": None},
+    methods=["GET"],
+)
+@app.route(
+    "/kirjasto/luokitus/<string:key>/",
+    defaults={"page": None},
+    methods=["GET"],
+)
+@app.route("/kirjasto/luokitus/<string:key>/<int:page>/", methods=["GET"])
+def library_class_page(key: str | None, page: int | None):
+    index = classification.get_index()
+
+    # Without a key, the page lists the top-level classes.
+    if key is None:
+        classes = index.top_level()
+        totals = library.get_class_book_totals([c.id for c in classes])
+        return render_template(
+            "library_class.html",
+            book_class=None,
+            breadcrumbs=[],
+            subclasses=classes,
+            totals=totals,
+            **context,
+        )
+
+    book_class = index.get_by_key(key)
+    if not book_class:
+        abort(404)
+
+    subclasses = index.children(book_class.id)
+    totals = library.get_class_book_totals(
+        [book_class.id, *(c.id for c in subclasses)]
+    )
+    book_count = totals[book_class.id]
+
+    per_page = request.args.get("per_page")
+    page_size = 10
+    if per_page:
+        page_size = int(per_page)
+
+    page_count = math.ceil(book_count / page_size) if book_count > 0 else 1
+
+    params: str = ""
+    if per_page:
+        params = f"?per_page={per_page}"
+
+    if (page and page <= 1) or "reset_page" in request.args:
+        # I want the default URL to be clean.
+        return redirect(f"/kirjasto/luokitus/{key}/{params}")
+
+    # Set the correct page after checking for the redirection so that we
+    # don't get infinite loop.
+    if not page or page <= 1:
+        page = 1
+
+    if page > page_count:
+        return redirect(f"/kirjasto/luokitus/{key}/{page_count}/{params}")
+
+    cursor, backwards = get_page_cursor()
+    result = library.get_books_in_class(
+        book_class.id, page, page_size, cursor, backwards
+    )
+    query = params[1:]
+    prev_url = (
+        pagination_url(
+            f"/kirjasto/luokitus/{key}/{page - 1}/",
+            "before",
+            result.prev_cursor,
+            query,
+        )
+        if page > 1
+        else None
+    )
+    next_url = (
+        pagination_url(
+            f"/kirjasto/luokitus/{key}/{page + 1}/",
+            "after",
+            result.next_cursor,
+            query,
+        )
+        if page < page_count and result.next_cursor
+        else None
+    )
+
+    owned: dict[int, int] = {}
+    read_books: set[int] = set()
+    if "user_id" in session:
+        user_id = cast(int, session["user_id"])
+        book_ids = [b.id for b in result.books]
+        owned = library.get_owned_counts_for_books(user_id, book_ids)
+        read_books = library.get_read_book_ids(user_id, book_ids)
+
+    return render_template(
+        "library_class.html",
+        book_class=book_class,
+        breadcrumbs=index.ancestors(book_class.id),
+        subclasses=subclasses,
+        totals=totals,
+        book_count=book_count,
+        books=result.books,
+        page=page,
+        page_count=page_count,
+        prev_url=prev_url,
+        next_url=next_url,
+        page_size=page_size,
+        owned=owned,
+        read_books=read_books,
         **context,
     )
 
@@ -607,61 +981,37 @@ def add_book_page() -> str | Response:
 
 
 @app.route("/kirja/<int:book_id>", methods=["GET"])
+@etag.versioned(
+    lambda book_id: [
+        library.get_book_version(book_id),
+        *cache.get_versions(["authors", "users"]),
+    ]
+)
 def book_page(book_id: int):
-    book = library.get_book_by_id(book_id)
-    if not book:
+    user_id = cast(int | None, session.get("user_id"))
+    data = library.get_book_page_data(book_id, user_id)
+    if not data:
         abort(404)
-    book_author = author.get_author_by_id(book.author_id)
-    if not book_author:
-        abort(500)
-    book_class = library.get_classification_by_id(book.class_id)
-    if not book_class:
-        abort(500)
-
-    owns = (
-        library.is_owner(cast(int, session["user_id"]), book_id)
-        if "user_id" in session
-        else False
-    )
-    count = library.get_book_total_owned_count(book_id)
-    owned_count = (
-        library.get_book_user_owned_count(
-            book_id, cast(int, session["user_id"])
-        )
-        if "user_id" in session
-        else 0
+    review_cursor = request.args.get("after") or None
+    review_page = library.get_reviews(
+        book_id, REVIEWS_PAGE_SIZE, review_cursor
     )
-    is_read = (
-        library.is_read(cast(int, session["user_id"]), book_id)
-        if "user_id" in session
-        else False
-    )
-    reviews = library.get_reviews(book_id)
-    has_left_review = (
-        library.has_left_review(cast(int, session["user_id"]), book_id)
-        if "user_id" in session
-        else False
-    )
-    _ = locale.setlocale(locale.LC_TIME, "fi_FI")
-    fmt_times: Mapping[int, str] = {}
-    for r in reviews:
-        fmt_times[r.id] = r.timestamp.strftime("%A %d.%m.%Y klo %H.%M")
-    fmt_last_edited: Mapping[int, str] = {}
-    for r in reviews:
-        fmt_last_edited[r.id] = r.last_edited.strftime("%A %d.%m.%Y klo %H.%M")
+    reviews = review_page.reviews
     return render_template(
         "book.html",
-        author=book_author,
-        book=book,
-        book_class=book_class,
-        owns=owns,
-        count=count,
-        owned_count=owned_count,
-        has_read=is_read,
+        author=data.author,
+        book=data.book,
+        book_class=data.book_class,
+        owns=data.user_count > 0,
+        count=data.total_count,
+        owned_count=data.user_count,
+        has_read=data.has_read,
+        rating=data.rating,
         reviews=reviews,
-        has_left_review=has_left_review,
-        fmt_times=fmt_times,
-        fmt_last_edited=fmt_last_edited,
+        review_cursor=review_cursor,
+        next_reviews_cursor=review_page.next_cursor,
+        has_left_review=data.has_left_review,
+        review_version=cache.get_versions(["reviews", "users"]),
         **context,
     )
 
@@ -1007,16 +1357,8 @@ def edit_review(book_id: int):
     review = library.get_user_review(book.id, cast(int, session["user_id"]))
     if not review:
         abort(404)
-    _ = locale.setlocale(locale.LC_TIME, "fi_FI")
-    fmt_time: str = review.timestamp.strftime("%A %d.%m.%Y klo %H.%M")
-    fmt_last_edited: str = review.last_edited.strftime("%A %d.%m.%Y klo %H.%M")
     return render_template(
-        "edit_review.html",
-        book=book,
-        review=review,
-        fmt_time=fmt_time,
-        fmt_last_edited=fmt_last_edited,
-        **context,
+        "edit_review.html", book=book, review=review, **context
     )
 
 
@@ -1177,3 +1519,30 @@ def lines(s: str) -> str:
     s = str(markupsafe.escape(s))
     s = s.replace("\n", "<br>")
     return markupsafe.Markup(s)
+
+
+# The names of the weekdays in Finnish in the order of
+# datetime.weekday().
+WEEKDAYS = (
+    "maanantai",
+    "tiistai",
+    "keskiviikko",
+    "torstai",
+    "perjantai",
+    "lauantai",
+    "sunnuntai",
+)
+
+
+@app.template_filter()
+def finnish_datetime(d: datetime) -> str:
+    """
+    Jinja filter for formatting a timestamp in Finnish, for example
+    "maanantai 06.01.2025 klo 14.05". The names of the weekdays are
+    looked up from WEEKDAYS instead of the locale, as the locale is
+    shared by every thread of the process.
+    """
+    return (
+        f"{WEEKDAYS[d.weekday()]} {d.day:02}.{d.month:02}.{d.year}"
+        f" klo {d.hour:02}.{d.minute:02}"
+    )
@@ -3,6 +3,7 @@ from dataclasses import dataclass
 from typing import TypedDict, cast
 
 from flask import request
+import cache
 import db
 
 
@@ -40,6 +41,7 @@ def create_author(first_name: str | None, surname: str):
         # Automatically insert NULL as the value for first name.
         sql = "INSERT INTO authors (surname) VALUES (?)"
         db.execute(sql, [surname.strip()])
+    cache.invalidate("authors")
 
 
 def get_author(first_name: str, surname: str) -> Author | None:
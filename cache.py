@@ -0,0 +1,514 @@
+import functools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import ClassVar, ParamSpec, TypeVar, cast
+
+import markupsafe
+from flask import g, has_app_context
+from jinja2 import nodes
+from jinja2.ext import Extension
+from jinja2.parser import Parser
+
+import db
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+@dataclass
+class Settings:
+    """
+    Settings holds the configuration of the result cache. `backend` is
+    one of "memory", "sqlite" or "none":
+
+    - "memory" keeps the results in the memory of each process.
+    - "sqlite" keeps the results in the SQLite database at `database` so
+      that every worker process shares them.
+    - "none" turns the cache off.
+
+    An entry is dropped after `ttl` seconds even if the data it depends
+    on hasn't changed, and at most `size` entries are kept. The least
+    recently used entries are dropped first.
+
+    The rendered template fragments are always kept in the memory of the
+    process, as they are cheaper to render again than to load from
+    SQLite. At most `fragment_size` of them are kept.
+    """
+
+    backend: str = "memory"
+    ttl: float = 60.0
+    size: int = 1024
+    database: str = "cache.db"
+    fragment_size: int = 4096
+
+
+@dataclass
+class Entry:
+    """
+    Entry is a cached result. `versions` are the versions of the tags of
+    the entry at the time the result was computed, and the entry is only
+    valid as long as the tags still have the same versions.
+    """
+
+    value: object
+    tags: Sequence[str]
+    versions: Sequence[int]
+    expires_at: float
+
+
+@dataclass
+class Stats:
+    hits: int = 0
+    misses: int = 0
+
+
+class MemoryBackend:
+    """
+    MemoryBackend keeps the entries in a dictionary in the order of their
+    use. The entries are shared by the threads of the process, so the
+    cached values must not be modified.
+    """
+
+    def __init__(self, size: int):
+        self.size: int = size
+        self._entries: OrderedDict[str, Entry] = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def get(self, key: str) -> Entry | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                _ = self._entries.popitem(last=False)
+
+    def invalidate(self, tags: Sequence[str]):
+        with self._lock:
+            for key in [
+                key
+                for key, entry in self._entries.items()
+                if any(tag in entry.tags for tag in tags)
+            ]:
+                del self._entries[key]
+
+
+class SQLiteBackend:
+    """
+    SQLiteBackend keeps the entries in a SQLite database of their own so
+    that the worker processes share them. The values are pickled. Each
+    thread uses a connection of its own.
+
+    The time an entry was last used is only updated when it is older than
+    TOUCH_INTERVAL, so that the hot entries don't turn every hit into a
+    write.
+    """
+
+    TOUCH_INTERVAL: float = 1.0
+
+    def __init__(self, database: str, size: int):
+        self.database: str = database
+        self.size: int = size
+        self._local: threading.local = threading.local()
+        con = self._connect()
+        try:
+            _ = con.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                  key TEXT PRIMARY KEY,
+                  tags TEXT NOT NULL,
+                  value BLOB NOT NULL,
+                  expires_at REAL NOT NULL,
+                  used_at REAL NOT NULL
+                );
+
+                CREATE INDEX IF NOT EXISTS cache_entries_used_at_index
+                ON cache_entries (used_at);
+                """
+            )
+        finally:
+            con.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        con = sqlite3.connect(self.database, isolation_level=None)
+        _ = con.execute("PRAGMA busy_timeout = 1000")
+        _ = con.execute("PRAGMA journal_mode = WAL")
+        # Losing the latest entries in a crash doesn't matter for a cache.
+        _ = con.execute("PRAGMA synchronous = OFF")
+        return con
+
+    def _connection(self) -> sqlite3.Connection:
+        # The connections must not be shared with a forked process.
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            self._local.con = self._connect()
+            self._local.pid = pid
+        return cast(sqlite3.Connection, self._local.con)
+
+    def get(self, key: str) -> Entry | None:
+        con = self._connection()
+        row = con.execute(
+            """
+            SELECT value, expires_at, used_at
+            FROM cache_entries
+            WHERE key = ?
+            """,
+            [key],
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if row[1] <= now:
+            _ = con.execute("DELETE FROM cache_entries WHERE key = ?", [key])
+            return None
+        if now - row[2] > self.TOUCH_INTERVAL:
+            _ = con.execute(
+                "UPDATE cache_entries SET used_at = ? WHERE key = ?",
+                [now, key],
+            )
+        return cast(Entry, pickle.loads(row[0]))
+
+    def set(self, key: str, entry: Entry):
+        con = self._connection()
+        _ = con.execute("BEGIN IMMEDIATE")
+        try:
+            _ = con.execute(
+                """
+                INSERT OR REPLACE INTO cache_entries (
+                  key,
+                  tags,
+                  value,
+                  expires_at,
+                  used_at
+                )
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [
+                    key,
+                    # The tags are surrounded by spaces so that they can
+                    # be matched as whole words.
+                    f" {' '.join(entry.tags)} ",
+                    pickle.dumps(entry),
+                    entry.expires_at,
+                    time.time(),
+                ],
+            )
+            _ = con.execute(
+                """
+                DELETE FROM cache_entries
+                WHERE key IN (
+                    SELECT key
+                    FROM cache_entries
+                    ORDER BY used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                [self.size],
+            )
+            _ = con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                _ = con.execute("ROLLBACK")
+            raise
+
+    def invalidate(self, tags: Sequence[str]):
+        con = self._connection()
+        for tag in tags:
+            _ = con.execute(
+                "DELETE FROM cache_entries WHERE instr(tags, ?) > 0",
+                [f" {tag} "],
+            )
+
+
+Backend = MemoryBackend | SQLiteBackend
+
+_settings = Settings()
+_backend: Backend | None = MemoryBackend(_settings.size)
+_fragments: MemoryBackend | None = MemoryBackend(_settings.fragment_size)
+_stats: dict[str, Stats] = {}
+_stats_lock = threading.Lock()
+
+
+def settings_from_env() -> Settings:
+    """
+    Reads the cache settings from the environment variables. Every
+    setting that is not set uses the default value.
+    """
+    default = Settings()
+    return Settings(
+        backend=os.environ.get("CACHE_BACKEND", default.backend).lower(),
+        ttl=float(os.environ.get("CACHE_TTL", str(default.ttl))),
+        size=int(os.environ.get("CACHE_SIZE", str(default.size))),
+        database=os.environ.get("CACHE_DATABASE", default.database),
+        fragment_size=int(
+            os.environ.get("CACHE_FRAGMENT_SIZE", str(default.fragment_size))
+        ),
+    )
+
+
+def configure(settings: Settings | None = None):
+    """
+    Sets up the cache with the given settings. The settings are read from
+    the environment variables if they are not given.
+    """
+    global _settings, _backend, _fragments
+    _settings = settings if settings is not None else settings_from_env()
+    if _settings.backend == "memory":
+        _backend = MemoryBackend(_settings.size)
+    elif _settings.backend == "sqlite":
+        _backend = SQLiteBackend(_settings.database, _settings.size)
+    elif _settings.backend == "none":
+        _backend = None
+    else:
+        raise ValueError(f"unknown cache backend: {_settings.backend}")
+    _fragments = (
+        MemoryBackend(_settings.fragment_size)
+        if _backend is not None
+        else None
+    )
+    print(
+        "Cache settings:",
+        f"backend={_settings.backend}, ttl={_settings.ttl},",
+        f"size={_settings.size}, fragment_size={_settings.fragment_size}",
+    )
+
+
+def get_versions(tags: Sequence[str]) -> tuple[int, ...]:
+    """
+    Returns the versions of the given tags in the given order. The tags
+    are the names of the tables in data_versions, and their versions are
+    bumped by triggers on every change to the tables, so the versions are
+    the same for every process.
+    """
+    placeholders = ", ".join("?" * len(tags))
+    sql = f"""
+        SELECT name, version
+        FROM data_versions
+        WHERE name IN ({placeholders})
+    """
+    result = db.query(sql, tags)
+    versions = {row["name"]: row["version"] for row in result}
+    return tuple(versions.get(tag, 0) for tag in tags)
+
+
+def _count(name: str, hit: bool, request: bool = True):
+    with _stats_lock:
+        stats = _stats.setdefault(name, Stats())
+        if hit:
+            stats.hits += 1
+        else:
+            stats.misses += 1
+    if request and has_app_context():
+        if "cache_stats" not in g:
+            g.cache_stats = Stats()
+        request_stats = cast(Stats, g.cache_stats)
+        if hit:
+            request_stats.hits += 1
+        else:
+            request_stats.misses += 1
+
+
+def get_stats() -> dict[str, Stats]:
+    """
+    Returns the hits and the misses of each cached function in this
+    process.
+    """
+    with _stats_lock:
+        return {
+            name: Stats(hits=s.hits, misses=s.misses)
+            for name, s in _stats.items()
+        }
+
+
+def get_request_stats() -> Stats:
+    """
+    Returns the hits and the misses of the cache during the current
+    request.
+    """
+    return cast(Stats, g.get("cache_stats", Stats()))
+
+
+def cached(*tags: str) -> Callable[[Callable[P, T]], Callable[P, T]]:
+    """
+    Caches the results of the decorated function by its arguments. The
+    tags are the tables that the result depends on, and a result is only
+    used as long as none of the tables has changed since it was computed.
+    The arguments must have a stable repr().
+    """
+
+    def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            backend = _backend
+            if backend is None:
+                return func(*args, **kwargs)
+
+            key = f"{name}{args!r}{sorted(kwargs.items())!r}"
+            versions = get_versions(tags)
+            try:
+                entry = backend.get(key)
+            except (sqlite3.Error, pickle.PickleError) as e:
+                print("cache error:", e)
+                entry = None
+            if entry is not None and tuple(entry.versions) == versions:
+                _count(name, True)
+                return cast(T, entry.value)
+
+            _count(name, False)
+            value = func(*args, **kwargs)
+            try:
+                backend.set(
+                    key,
+                    Entry(
+                        value=value,
+                        tags=tags,
+                        versions=versions,
+                        expires_at=time.time() + _settings.ttl,
+                    ),
+                )
+            except (sqlite3.Error, pickle.PickleError) as e:
+                print("cache error:", e)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(*tags: str):
+    """
+    Drops the cached results that depend on any of the given tables.
+    The changes to the tables already make the results stale through
+    their versions, but dropping them right away frees the space for the
+    other entries.
+    """
+    backend = _backend
+    if backend is None:
+        return
+    try:
+        backend.invalidate(tags)
+    except sqlite3.Error as e:
+        print("cache error:", e)
+
+
+def get_fragment(key: str) -> markupsafe.Markup | None:
+    """
+    Returns the rendered HTML fragment cached under the key, or None if
+    it has to be rendered.
+    """
+    fragments = _fragments
+    if fragments is None:
+        return None
+    entry = fragments.get(key)
+    # The fragments are only counted for the process, as looking up the
+    # request for every row of a listing would cost about as much as
+    # rendering the row.
+    _count("fragments", entry is not None, request=False)
+    return cast(markupsafe.Markup, entry.value) if entry is not None else None
+
+
+def set_fragment(key: str, html: str):
+    """
+    Caches a rendered HTML fragment under the key. The key must change
+    whenever the fragment would be rendered differently.
+    """
+    fragments = _fragments
+    if fragments is None:
+        return
+    fragments.set(
+        key,
+        Entry(
+            value=markupsafe.Markup(html),
+            tags=(),
+            versions=(),
+            expires_at=time.time() + _settings.ttl,
+        ),
+    )
+
+
+class FragmentCacheExtension(Extension):
+    """
+    FragmentCacheExtension adds the `cache` tag to the templates. The
+    body of the tag is rendered once and then reused for as long as the
+    values after the tag stay the same:
+
+        {% cache book.id, listing_version %}
+          <div>{{ book.name }}</div>
+        {% endcache %}
+
+    The values are usually the ID of the row and the versions of the
+    tables it comes from. The fragments of different tags are kept apart
+    by the name of the template and the line of the tag, so the body must
+    only depend on the values and not on the session, for example.
+
+    The tag is compiled to the equivalent of
+
+        {% set html = get(key) %}
+        {% if html is none %}
+          {% set html %}...{% endset %}
+          {% do set(key, html) %}
+        {% endif %}
+        {{ html }}
+
+    rather than a call block, as a call block creates a macro for every
+    row, which costs more than rendering a small fragment.
+    """
+
+    tags: ClassVar[set[str]] = {"cache"}
+
+    def parse(self, parser: Parser) -> nodes.Node:
+        lineno = next(parser.stream).lineno
+        name = nodes.Const(f"{parser.name}:{lineno}")
+        values: list[nodes.Expr] = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            values.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+
+        html = f"_cache_html_{lineno}"
+        key = [name, nodes.List(values)]
+        return [
+            nodes.Assign(
+                nodes.Name(html, "store"), self.call_method("_get", key)
+            ),
+            nodes.If(
+                nodes.Test(
+                    nodes.Name(html, "load"), "none", [], [], None, None
+                ),
+                [
+                    nodes.AssignBlock(nodes.Name(html, "store"), None, body),
+                    nodes.ExprStmt(
+                        self.call_method(
+                            "_set", [*key, nodes.Name(html, "load")]
+                        )
+                    ),
+                ],
+                [],
+                [],
+            ),
+            nodes.Output([nodes.Name(html, "load")]),
+        ]
+
+    def _get(
+        self, name: str, values: list[object]
+    ) -> markupsafe.Markup | None:
+        return get_fragment(f"{name}{values!r}")
+
+    def _set(self, name: str, values: list[object], html: str):
+        set_fragment(f"{name}{values!r}", html)
@@ -0,0 +1,195 @@
+import bisect
+import threading
+from array import array
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import TypedDict, cast
+
+import db
+
+
+@dataclass(frozen=True)
+class LibraryClass:
+    id: int
+    key: str
+    label: str
+
+
+ClassificationResult = TypedDict(
+    "ClassificationResult",
+    {"id": int, "key": str, "label": str, "lft": int, "rgt": int},
+)
+
+
+class ClassificationIndex:
+    """
+    ClassificationIndex is an immutable in-memory index of the
+    classification. The classification does not change after the
+    database has been initialized (see schema.sql), so the index is
+    loaded once per process and the lookups don't need the database.
+
+    The classes are stored in compact arrays sorted by `lft`, i.e. in
+    the order of the tree. As the classification uses the nested set
+    model, the descendants of a class are the classes right after it
+    whose `lft` is less than the `rgt` of the class, and they can be
+    found with a binary search.
+    """
+
+    def __init__(self, rows: Sequence[ClassificationResult]):
+        rows = sorted(rows, key=lambda r: r["lft"])
+        self._ids: array[int] = array("q", (r["id"] for r in rows))
+        self._keys: tuple[str, ...] = tuple(r["key"] for r in rows)
+        self._labels: tuple[str, ...] = tuple(r["label"] for r in rows)
+        self._lfts: array[int] = array("q", (r["lft"] for r in rows))
+        self._rgts: array[int] = array("q", (r["rgt"] for r in rows))
+
+        # The lowercase versions are used for searching.
+        self._search_keys = tuple(k.casefold() for k in self._keys)
+        self._search_labels = tuple(
+            (label or "").casefold() for label in self._labels
+        )
+
+        self._by_id: dict[int, int] = {id: i for i, id in enumerate(self._ids)}
+        self._by_key: dict[str, int] = {
+            key: i for i, key in enumerate(self._keys)
+        }
+
+        # Resolve the parents of the classes with a single pass over the
+        # tree. -1 marks a top-level class.
+        self._parents: array[int] = array("q", [-1] * len(rows))
+        stack: list[int] = []
+        for i in range(len(rows)):
+            while stack and self._rgts[stack[-1]] < self._lfts[i]:
+                _ = stack.pop()
+            if stack:
+                self._parents[i] = stack[-1]
+            stack.append(i)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _class(self, i: int) -> LibraryClass:
+        return LibraryClass(
+            id=self._ids[i], key=self._keys[i], label=self._labels[i]
+        )
+
+    def get(self, id: int) -> LibraryClass | None:
+        i = self._by_id.get(id)
+        return self._class(i) if i is not None else None
+
+    def get_by_key(self, key: str) -> LibraryClass | None:
+        i = self._by_key.get(key)
+        return self._class(i) if i is not None else None
+
+    def subtree_range(self, id: int) -> tuple[int, int] | None:
+        """
+        Returns the `lft` and `rgt` of the given class. The subtree of the
+        class consists of the classes whose `lft` is between these.
+        """
+        i = self._by_id.get(id)
+        return (self._lfts[i], self._rgts[i]) if i is not None else None
+
+    def ancestors(self, id: int) -> Sequence[LibraryClass]:
+        """
+        Returns the ancestors of the given class starting from the
+        top-level class.
+        """
+        i = self._by_id.get(id)
+        if i is None:
+            return []
+        result: list[LibraryClass] = []
+        i = self._parents[i]
+        while i >= 0:
+            result.append(self._class(i))
+            i = self._parents[i]
+        result.reverse()
+        return result
+
+    def breadcrumbs(self, id: int) -> Sequence[LibraryClass]:
+        """
+        Returns the path from the top-level class to the given class,
+        including the class itself.
+        """
+        c = self.get(id)
+        if c is None:
+            return []
+        return [*self.ancestors(id), c]
+
+    def children(self, id: int) -> Sequence[LibraryClass]:
+        i = self._by_id.get(id)
+        if i is None:
+            return []
+        return [
+            self._class(j)
+            for j in range(i + 1, self._end(i))
+            if self._parents[j] == i
+        ]
+
+    def descendants(self, id: int) -> Sequence[LibraryClass]:
+        """
+        Returns all of the classes in the subtree of the given class,
+        excluding the class itself, in the order of the tree.
+        """
+        i = self._by_id.get(id)
+        if i is None:
+            return []
+        return [self._class(j) for j in range(i + 1, self._end(i))]
+
+    def top_level(self) -> Sequence[LibraryClass]:
+        return [self._class(i) for i, p in enumerate(self._parents) if p < 0]
+
+    def _end(self, i: int) -> int:
+        # The subtree of the class ends at the first class that starts
+        # after the right boundary of the class.
+        return bisect.bisect_right(self._lfts, self._rgts[i], lo=i + 1)
+
+    def search(
+        self, key: str, label_queries: Sequence[str]
+    ) -> Sequence[LibraryClass]:
+        """
+        Returns the classes whose key contains the given key or whose
+        label contains any of the given label queries. The matching is
+        case-insensitive.
+        """
+        key = key.casefold()
+        queries = [q.casefold() for q in label_queries if q]
+        result: list[LibraryClass] = []
+        for i in range(len(self._ids)):
+            if (key and key in self._search_keys[i]) or any(
+                q in self._search_labels[i] for q in queries
+            ):
+                result.append(self._class(i))
+        return result
+
+
+_index: ClassificationIndex | None = None
+_index_lock = threading.Lock()
+
+
+def load() -> ClassificationIndex:
+    """
+    Reads the classification from the database into a new index.
+    """
+    # The index is shared by the whole process and it might be loaded
+    # outside of a request, so it uses a connection of its own.
+    con = db.connect()
+    try:
+        rows = con.execute(
+            "SELECT id, key, label, lft, rgt FROM classification"
+        ).fetchall()
+    finally:
+        con.close()
+    return ClassificationIndex(cast(Sequence[ClassificationResult], rows))
+
+
+def get_index() -> ClassificationIndex:
+    """
+    Returns the classification index of the process. The index is loaded
+    on the first call.
+    """
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = load()
+    return _index
@@ -1,18 +1,301 @@
+import logging
+import logging.handlers
+import os
+import queue
+import re
 import sqlite3
+import time
 from collections.abc import Sequence
+from dataclasses import dataclass
 from typing import Any, cast
 
-from flask import g
+from flask import Flask, g, has_app_context
 
+# The maximum number of idle connections kept in the pool of a single
+# process. Connections opened on top of this when the pool is empty are
+# closed instead of returned once the request is done with them.
+POOL_SIZE = 8
 
-def get_connection() -> sqlite3.Connection:
-    con = sqlite3.connect("database.db")
+_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(POOL_SIZE)
+_pool_pid = os.getpid()
+
+
+@dataclass
+class Profile:
+    """
+    Profile holds the runtime settings that are applied to every
+    connection when it is opened. The defaults are tuned for a read-heavy
+    web app: WAL lets the readers run while a request is writing, and
+    the page cache and memory-mapped I/O keep the hot pages of the large
+    tables in memory.
+
+    `cache_size` follows the semantics of the pragma: a negative value is
+    the size of the cache in KiB.
+    """
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size: int = -64 * 1024
+    temp_store: str = "MEMORY"
+    busy_timeout: int = 5000
+
+
+_profile = Profile()
+_database = "database.db"
+
+
+@dataclass
+class Instrumentation:
+    """
+    Instrumentation holds the settings for recording the queries. Every
+    statement that takes at least `slow_query_ms` milliseconds is written
+    to the rotating log file at `slow_query_log`, or to slow_queries.log in
+    the instance folder of the app if it is not set. If `explain` is set,
+    the query plan of the statement is written with it.
+    """
+
+    slow_query_ms: float = 100.0
+    slow_query_log: str | None = None
+    explain: bool = False
+
+
+@dataclass
+class QueryStat:
+    """
+    QueryStat is the record of a single statement run during a request.
+    """
+
+    sql: str
+    duration_ms: float
+    rows: int
+
+
+_instrumentation = Instrumentation()
+_slow_log = logging.getLogger("db.slow")
+
+
+def profile_from_env() -> Profile:
+    """
+    Reads the connection profile from the environment variables. Every
+    setting that is not set uses the default value.
+    """
+    default = Profile()
+    return Profile(
+        journal_mode=os.environ.get(
+            "SQLITE_JOURNAL_MODE", default.journal_mode
+        ),
+        synchronous=os.environ.get("SQLITE_SYNCHRONOUS", default.synchronous),
+        mmap_size=int(
+            os.environ.get("SQLITE_MMAP_SIZE", str(default.mmap_size))
+        ),
+        cache_size=int(
+            os.environ.get("SQLITE_CACHE_SIZE", str(default.cache_size))
+        ),
+        temp_store=os.environ.get("SQLITE_TEMP_STORE", default.temp_store),
+        busy_timeout=int(
+            os.environ.get("SQLITE_BUSY_TIMEOUT", str(default.busy_timeout))
+        ),
+    )
+
+
+def instrumentation_from_env() -> Instrumentation:
+    """
+    Reads the query instrumentation settings from the environment
+    variables. Every setting that is not set uses the default value.
+    """
+    default = Instrumentation()
+    return Instrumentation(
+        slow_query_ms=float(
+            os.environ.get("SLOW_QUERY_MS", str(default.slow_query_ms))
+        ),
+        slow_query_log=os.environ.get("SLOW_QUERY_LOG")
+        or default.slow_query_log,
+        explain=os.environ.get("SLOW_QUERY_EXPLAIN", "0").lower()
+        in ("1", "true", "yes"),
+    )
+
+
+def init_app(
+    app: Flask,
+    profile: Profile | None = None,
+    instrumentation: Instrumentation | None = None,
+    database: str | None = None,
+):
+    """
+    Registers the database connection handling for the given app and
+    sets the profile used for the new connections. The database file is
+    read from the DATABASE environment variable if it is not given.
+    """
+    global _profile, _instrumentation, _database
+    _database = (
+        database
+        if database is not None
+        else os.environ.get("DATABASE", "database.db")
+    )
+    _profile = profile if profile is not None else profile_from_env()
+    _instrumentation = (
+        instrumentation
+        if instrumentation is not None
+        else instrumentation_from_env()
+    )
+    if not _slow_log.handlers:
+        log_file = _instrumentation.slow_query_log
+        if log_file is None:
+            os.makedirs(app.instance_path, exist_ok=True)
+            log_file = os.path.join(app.instance_path, "slow_queries.log")
+        handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=5 * 1024 * 1024, backupCount=3, delay=True
+        )
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        _slow_log.addHandler(handler)
+        _slow_log.setLevel(logging.INFO)
+        _slow_log.propagate = False
+    app.teardown_appcontext(close_connection)
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Opens a new connection to the database. Most of the code should use
+    get_connection instead as it reuses the pooled connections.
+    """
+    # The connections are shared by the worker threads through the pool
+    # so they must not be bound to the thread that created them. A
+    # connection is only used by one request at a time.
+    con = sqlite3.connect(_database, check_same_thread=False)
     _ = con.execute("PRAGMA foreign_keys = ON")
+    apply_profile(con, _profile)
     # Old factory: con.row_factory = sqlite3.Row
     con.row_factory = dict_factory
     return con
 
 
+# The values accepted for the settings of the profile that are not
+# integers.
+JOURNAL_MODES = ("WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY", "OFF")
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+TEMP_STORES = ("DEFAULT", "FILE", "MEMORY")
+
+
+def _choice(name: str, value: str, choices: Sequence[str]) -> str:
+    choice = value.strip().upper()
+    if choice not in choices:
+        raise ValueError(
+            f"invalid {name}: {value!r}, expected one of {', '.join(choices)}"
+        )
+    return choice
+
+
+def apply_profile(con: sqlite3.Connection, profile: Profile):
+    # The values cannot be passed as parameters to the pragmas. They
+    # come from the configuration and not from the users, but they are
+    # still checked so that nothing else ends up in the statements. An
+    # unknown value would otherwise be ignored by SQLite without an error.
+    journal_mode = _choice("journal_mode", profile.journal_mode, JOURNAL_MODES)
+    synchronous = _choice(
+        "synchronous", profile.synchronous, SYNCHRONOUS_MODES
+    )
+    temp_store = _choice("temp_store", profile.temp_store, TEMP_STORES)
+    _ = con.execute(f"PRAGMA busy_timeout = {int(profile.busy_timeout)}")
+    _ = con.execute(f"PRAGMA journal_mode = {journal_mode}")
+    _ = con.execute(f"PRAGMA synchronous = {synchronous}")
+    _ = con.execute(f"PRAGMA mmap_size = {int(profile.mmap_size)}")
+    _ = con.execute(f"PRAGMA cache_size = {int(profile.cache_size)}")
+    _ = con.execute(f"PRAGMA temp_store = {temp_store}")
+
+
+def check_settings() -> dict[str, str]:
+    """
+    Reads the settings that are actually in use back from a new
+    connection and reports them. SQLite silently ignores some of the
+    settings, for example WAL mode on file systems that do not support
+    it, so this is run at startup to make that visible.
+    """
+    if not os.path.exists(_database):
+        print(_database, "not found, run the migrations first")
+        return {}
+
+    con = connect()
+    settings: dict[str, str] = {}
+    try:
+        for name in (
+            "journal_mode",
+            "synchronous",
+            "mmap_size",
+            "cache_size",
+            "temp_store",
+            "busy_timeout",
+            "foreign_keys",
+        ):
+            row = cast(
+                dict[str, object], con.execute(f"PRAGMA {name}").fetchone()
+            )
+            settings[name] = str(next(iter(row.values())))
+    finally:
+        con.close()
+
+    print(
+        "SQLite settings:",
+        ", ".join(f"{key}={value}" for key, value in settings.items()),
+    )
+    if settings["journal_mode"].upper() != _profile.journal_mode.upper():
+        print(
+            "warning: requested journal_mode",
+            _profile.journal_mode,
+            "but the database uses",
+            settings["journal_mode"],
+        )
+
+    return settings
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns the database connection of the current request. The
+    connection is taken from the pool on first use and returned to it
+    when the request ends.
+    """
+    if "db_connection" not in g:
+        g.db_connection = _acquire()
+    return cast(sqlite3.Connection, g.db_connection)
+
+
+def close_connection(_: BaseException | None = None):
+    """
+    Returns the connection of the current request back to the pool.
+    """
+    con = cast(sqlite3.Connection | None, g.pop("db_connection", None))
+    if con is not None:
+        _release(con)
+
+
+def _acquire() -> sqlite3.Connection:
+    global _pool, _pool_pid
+    # The connections must not be shared with a forked process, so a
+    # process gets a pool of its own.
+    if _pool_pid != os.getpid():
+        _pool = queue.LifoQueue(POOL_SIZE)
+        _pool_pid = os.getpid()
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return connect()
+
+
+def _release(con: sqlite3.Connection):
+    if _pool_pid != os.getpid():
+        con.close()
+        return
+    try:
+        # A failed request might leave a transaction open, and that must
+        # not leak to the next user of the connection.
+        if con.in_transaction:
+            con.rollback()
+        _pool.put_nowait(con)
+    except (queue.Full, sqlite3.Error):
+        con.close()
+
+
 def dict_factory(
     cursor: sqlite3.Cursor,
     row: tuple[Any, ...],  # pyright: ignore[reportExplicitAny]
@@ -21,14 +304,63 @@ def dict_factory(
     return {key: value for key, value in zip(fields, row)}  # pyright: ignore[reportAny]
 
 
+def normalize_sql(sql: str) -> str:
+    """
+    Returns the statement on a single line so that the same query is
+    always reported the same way. The placeholder lists of IN queries
+    are collapsed as their length depends on the page.
+    """
+    sql = " ".join(sql.split())
+    return re.sub(r"\?(?:\s*,\s*\?)+", "?, ...", sql)
+
+
+def get_query_stats() -> Sequence[QueryStat]:
+    """
+    Returns the statements run during the current request.
+    """
+    return cast(list[QueryStat], g.get("db_queries", []))
+
+
+def _record(
+    con: sqlite3.Connection,
+    sql: str,
+    params: Sequence[Any],  # pyright: ignore[reportExplicitAny]
+    start: float,
+    rows: int,
+):
+    duration_ms = (time.perf_counter() - start) * 1000
+    stat = QueryStat(
+        sql=normalize_sql(sql), duration_ms=duration_ms, rows=rows
+    )
+    if has_app_context():
+        if "db_queries" not in g:
+            g.db_queries = []
+        cast(list[QueryStat], g.db_queries).append(stat)
+
+    if duration_ms < _instrumentation.slow_query_ms:
+        return
+    message = f"{duration_ms:.1f} ms, {rows} rows: {stat.sql}"
+    if _instrumentation.explain:
+        try:
+            plan = cast(
+                list[dict[str, object]],
+                con.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall(),
+            )
+            message += "".join(f"\n    {p['detail']}" for p in plan)
+        except sqlite3.Error as e:
+            message += f"\n    (no query plan: {e})"
+    _slow_log.info(message)
+
+
 def execute(sql: str, params: Sequence[Any] | None = None) -> None:  # pyright: ignore[reportExplicitAny]
     if params is None:
         params = []
     con = get_connection()
+    start = time.perf_counter()
     result = con.execute(sql, params)
     con.commit()
+    _record(con, sql, params, start, result.rowcount)
     g.last_insert_id = result.lastrowid
-    con.close()
 
 
 def last_insert_id() -> int:
@@ -39,6 +371,7 @@ def query(sql: str, params: Sequence[Any] | None = None) -> Sequence[Any]:  # py
     if params is None:
         params = []
     con = get_connection()
+    start = time.perf_counter()
     result = con.execute(sql, params).fetchall()
-    con.close()
+    _record(con, sql, params, start, len(result))
     return result
@@ -13,4 +13,6 @@ def read_env_file():
         i = s.find("=")
         name = s[0:i]
         value = s[i + 2 : -1]
-        os.environ[name] = value
+        # The variables that are already set in the environment take
+        # precedence so that the scripts can override the settings.
+        _ = os.environ.setdefault(name, value)
@@ -0,0 +1,107 @@
+import hashlib
+import os
+from collections.abc import Callable, Sequence
+from typing import TypeVar
+
+from flask import g, request, session
+from werkzeug.wrappers import Response
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+
+# Returns the versions of the data that the page depends on, or None if
+# the page should always be built, for example because it doesn't
+# exist.
+Versions = Callable[..., Sequence[object] | None]
+
+F = TypeVar("F", bound=Callable[..., object])
+
+_versions: dict[str, Versions] = {}
+
+
+def _code_version() -> str:
+    """
+    Returns a checksum of the modification times of the code and the
+    templates, so that the pages get new ETags when the app is updated.
+    """
+    h = hashlib.sha256()
+    for directory in (ROOT, os.path.join(ROOT, "templates")):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith((".py", ".html")):
+                path = os.path.join(directory, name)
+                h.update(f"{name}:{os.stat(path).st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+
+_code = _code_version()
+
+
+def versioned(versions: Versions) -> Callable[[F], F]:
+    """
+    Registers the view for conditional requests. `versions` is called
+    with the arguments of the view before the view runs, and the ETag of
+    the page is built from what it returns. The versions must change
+    whenever the data shown on the page changes.
+    """
+
+    def decorator(view: F) -> F:
+        _versions[view.__name__] = versions
+        return view
+
+    return decorator
+
+
+def check_request() -> Response | None:
+    """
+    Computes the ETag of the current request if its view is registered
+    and returns a 304 response if the client already has the page.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    versions = _versions.get(request.endpoint or "")
+    if versions is None:
+        return None
+    # The flashed messages are shown once, so the page must be built.
+    if "_flashes" in session:
+        return None
+    data = versions(**(request.view_args or {}))
+    if data is None:
+        return None
+
+    # The pages also show the user that is logged in and the CSRF token
+    # of the session.
+    parts = [
+        _code,
+        request.full_path,
+        session.get("user_id"),
+        session.get("username"),
+        session.get("csrf_token"),
+        *data,
+    ]
+    etag = hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    g.etag = etag
+    if not request.if_none_match.contains_weak(etag):
+        return None
+
+    response = Response(status=304)
+    _set_headers(response, etag)
+    return response
+
+
+def add_etag(response: Response) -> Response:
+    """
+    Adds the ETag computed for the current request to a successful
+    response.
+    """
+    etag = g.get("etag")
+    if etag is not None and response.status_code == 200:
+        _set_headers(response, etag)
+    return response
+
+
+def _set_headers(response: Response, etag: str):
+    response.set_etag(etag)
+    # The browser has to check with the server every time, as the pages
+    # change with the data and the session.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add("Cookie")
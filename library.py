@@ -1,10 +1,17 @@
+import base64
+import binascii
+import json
+import math
 from collections.abc import Sequence
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import TypedDict, cast
 
 from flask import abort
 
+import author
+import cache
+import classification
 import db
 import users
 
@@ -19,35 +26,59 @@ class Book:
 
 
 @dataclass
-class JointBook:
+class CountBook:
     id: int
     isbn: str | None
     name: str
     author: str
     classification: str
+    count: int
 
 
 @dataclass
-class CountBook:
-    id: int
-    isbn: str | None
-    name: str
-    author: str
-    classification: str
+class BookRating:
+    """
+    BookRating is the aggregated rating of a book. `histogram` contains
+    the number of reviews for each star count from one to five.
+    """
+
     count: int
+    star_sum: int
+    histogram: Sequence[int]
+
+    @property
+    def average(self) -> float | None:
+        return self.star_sum / self.count if self.count > 0 else None
 
 
 @dataclass
-class LibraryClass:
-    id: int
-    key: str
-    label: str
+class BookPageData:
+    """
+    BookPageData contains everything that the book page shows about the
+    book and its relation to the current user.
+    """
+
+    book: Book
+    author: author.Author
+    book_class: classification.LibraryClass
+    total_count: int
+    user_count: int
+    has_read: bool
+    has_left_review: bool
+    rating: BookRating
 
 
 @dataclass
-class BookIDCounts:
-    id: int
-    count: int
+class BookPage:
+    """
+    BookPage is a single page of a book listing. `prev_cursor` and
+    `next_cursor` are the opaque cursors for fetching the neighbouring
+    pages, and they are None if there is no such page.
+    """
+
+    books: Sequence[CountBook]
+    prev_cursor: str | None
+    next_cursor: str | None
 
 
 @dataclass
@@ -61,6 +92,30 @@ class Review:
     last_edited: datetime
 
 
+@dataclass
+class ReviewPage:
+    """
+    ReviewPage is a single page of the reviews of a book. `next_cursor`
+    is the cursor for the next page, or None if there are no more
+    reviews.
+    """
+
+    reviews: Sequence[Review]
+    next_cursor: str | None
+
+
+@dataclass
+class ResultCount:
+    """
+    ResultCount is the number of the results of a search. If `exact` is
+    not set, the counting was stopped at the limit, and there are more
+    than `count` results.
+    """
+
+    count: int
+    exact: bool
+
+
 BooksResult = TypedDict(
     "BooksResult",
     {
@@ -74,6 +129,30 @@ BooksResult = TypedDict(
 
 IDCountResult = TypedDict("IDCountResult", {"id": int, "total": int})
 
+BookPageResult = TypedDict(
+    "BookPageResult",
+    {
+        "id": int,
+        "isbn": str | None,
+        "name": str,
+        "author_id": int,
+        "class_id": int,
+        "first_name": str | None,
+        "surname": str,
+        "total": int,
+        "user_total": int,
+        "has_read": int,
+        "has_left_review": int,
+        "review_count": int | None,
+        "star_sum": int | None,
+        "stars_1": int | None,
+        "stars_2": int | None,
+        "stars_3": int | None,
+        "stars_4": int | None,
+        "stars_5": int | None,
+    },
+)
+
 CountBooksResult = TypedDict(
     "CountBooksResult",
     {
@@ -86,9 +165,20 @@ CountBooksResult = TypedDict(
     },
 )
 
-
-LibraryClassResult = TypedDict(
-    "LibraryClassResult", {"id": int, "key": str, "label": str}
+ListingBooksResult = TypedDict(
+    "ListingBooksResult",
+    {
+        "id": int,
+        "isbn": str | None,
+        "name": str,
+        "author": str,
+        "classification": str,
+        "total": int,
+        "class_lft": int,
+        "surname_key": str,
+        "first_name_key": str,
+        "name_key": str,
+    },
 )
 
 ReviewResult = TypedDict(
@@ -100,8 +190,8 @@ ReviewResult = TypedDict(
         "book_id": int,
         "stars": int,
         "message": str | None,
-        "time": str,
-        "last_edited": str,
+        "time": int,
+        "last_edited": int,
     },
 )
 
@@ -117,6 +207,7 @@ def create_book(isbn: str | None, name: str, author_id: int, class_id: int):
         VALUES (?, ?, ?, ?)
     """
     db.execute(sql, [isbn, name, author_id, class_id])
+    cache.invalidate("books")
 
 
 def add_review(
@@ -131,9 +222,17 @@ def add_review(
             time,
             last_edited
         )
-        VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))
+        VALUES (
+            ?,
+            ?,
+            ?,
+            ?,
+            CAST(strftime('%s', 'now') AS INTEGER),
+            CAST(strftime('%s', 'now') AS INTEGER)
+        )
     """
     db.execute(sql, [user_id, book_id, stars, message])
+    cache.invalidate("reviews")
 
 
 def update_review(
@@ -144,15 +243,17 @@ def update_review(
         SET
             stars = ?,
             message = ?,
-            last_edited = datetime('now')
+            last_edited = CAST(strftime('%s', 'now') AS INTEGER)
         WHERE user_id = ? AND book_id = ?
     """
     db.execute(sql, [stars, message, user_id, book_id])
+    cache.invalidate("reviews")
 
 
 def remove_review(user_id: int, book_id: int):
     sql = "DELETE FROM reviews WHERE user_id = ? AND book_id = ?"
     db.execute(sql, [user_id, book_id])
+    cache.invalidate("reviews")
 
 
 def mark_as_read(user_id: int, book_id: int):
@@ -164,6 +265,7 @@ def mark_as_read(user_id: int, book_id: int):
         VALUES (?, ?)
     """
     db.execute(sql, [user_id, book_id])
+    cache.invalidate("read_books")
 
 
 def get_user_library(user_id: int) -> int | None:
@@ -178,26 +280,31 @@ def add_book_to_user(book_id: int, user_id: int):
         VALUES (?, (SELECT id FROM libraries WHERE user_id = ?))
     """
     db.execute(sql, [book_id, user_id])
+    cache.invalidate("book_ownerships")
 
 
 def update_book_name(book_id: int, new_name: str):
     sql = "UPDATE books SET name = ? WHERE id = ?"
     db.execute(sql, [new_name, book_id])
+    cache.invalidate("books")
 
 
 def update_book_isbn(book_id: int, new_isbn: str):
     sql = "UPDATE books SET isbn = ? WHERE id = ?"
     db.execute(sql, [new_isbn, book_id])
+    cache.invalidate("books")
 
 
 def update_book_author(book_id: int, new_author_id: int):
     sql = "UPDATE books SET author_id = ? WHERE id = ?"
     db.execute(sql, [new_author_id, book_id])
+    cache.invalidate("books")
 
 
 def update_book_class(book_id: int, new_class_id: int):
     sql = "UPDATE books SET class_id = ? WHERE id = ?"
     db.execute(sql, [new_class_id, book_id])
+    cache.invalidate("books")
 
 
 def remove_books_from_user(book_id: int, user_id: int, count: int = 1):
@@ -206,48 +313,146 @@ def remove_books_from_user(book_id: int, user_id: int, count: int = 1):
         WHERE id IN (
             SELECT o.id
             FROM book_ownerships AS o
-            JOIN libraries AS l ON o.library_id = l.id
-            WHERE o.book_id = ? AND l.user_id = ?
+            WHERE o.book_id = ?
+                AND o.library_id IN (SELECT id FROM libraries WHERE user_id = ?)
             LIMIT ?
         )
     """
     db.execute(sql, [book_id, user_id, count])
+    cache.invalidate("book_ownerships")
+
+
+# The listings are sorted by this tuple. The columns are maintained in
+# books_listing (see migrations/011_create_books_listing_table.py), which
+# has indexes in this order. It ends with the ID of the book so that every
+# book has a unique position in the listing, and it is used as the key for
+# the keyset pagination.
+LISTING_SORT_KEY = (
+    "bl.class_lft",
+    "bl.surname_key",
+    "bl.first_name_key",
+    "bl.name_key",
+    "bl.book_id",
+)
 
+# The columns that the listing queries must select so that the cursors
+# can be created from the rows.
+LISTING_KEY_COLUMNS = """
+    bl.class_lft,
+    bl.surname_key,
+    bl.first_name_key,
+    bl.name_key
+"""
 
-def get_book_count() -> int:
-    sql = "SELECT COUNT(id) FROM books"
-    result = db.query(sql)
-    return result[0]["COUNT(id)"] if result else 0
 
+def encode_cursor(key: Sequence[str | int]) -> str:
+    """
+    Encodes the given sort key of a row into an opaque cursor that can
+    be used in URLs.
+    """
+    data = json.dumps(list(key), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
 
-def get_books(page: int, page_size: int):
-    sql = """
-        SELECT
-            b.id,
-            b.isbn,
-            b.name,
-            IFNULL(a.first_name, '') || ' ' || a.surname AS author,
-            c.label AS classification,
-            COUNT(o.id) AS total
-        FROM books AS b
-        JOIN book_ownerships AS o ON b.id = o.book_id
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
-        GROUP BY b.id
-        ORDER BY
-            c.key ASC,
-            a.surname ASC,
-            a.first_name ASC,
-            b.name ASC,
-            classification ASC,
-            total DESC
-        LIMIT ? OFFSET ?
+
+def decode_cursor(cursor: str, length: int) -> list[str | int]:
     """
-    limit = page_size
-    offset = page_size * (page - 1)
-    result = db.query(sql, [limit, offset])
+    Decodes a cursor created by encode_cursor. As the cursors come from
+    the URLs, invalid cursors result in a bad request.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key = cast(object, json.loads(data))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400)
+    if (
+        not isinstance(key, list)
+        or len(cast(list[object], key)) != length
+        or not all(
+            isinstance(k, (str, int)) and not isinstance(k, bool)
+            for k in cast(list[object], key)
+        )
+    ):
+        abort(400)
+    return cast(list[str | int], key)
+
+
+def _listing_cursor(row: ListingBooksResult) -> str:
+    return encode_cursor(
+        [
+            row["class_lft"],
+            row["surname_key"],
+            row["first_name_key"],
+            row["name_key"],
+            row["id"],
+        ]
+    )
+
+
+def _paginate_listing(
+    sql: str,
+    conditions: Sequence[str],
+    params: Sequence[str | int],
+    group_by: str,
+    page: int,
+    page_size: int,
+    cursor: str | None,
+    backwards: bool,
+    order_by: str | None = None,
+) -> BookPage:
+    """
+    Runs a listing query and returns the requested page of it. If a
+    cursor is given, the page is fetched using the keyset pagination:
+    the rows are sought directly after (or before, if `backwards` is
+    set) the position of the cursor so the database does not have to
+    skip the rows of the preceding pages. Otherwise the page number is
+    used for the offset.
+
+    If `order_by` is given, the rows are sorted by it instead of the
+    listing order. The cursors cannot be used with a custom order, so
+    the page number is always used for the offset.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if order_by is not None:
+        cursor = None
+
+    if cursor is not None:
+        operator = "<" if backwards else ">"
+        placeholders = ", ".join("?" * len(LISTING_SORT_KEY))
+        conditions.append(
+            f"({', '.join(LISTING_SORT_KEY)}) {operator} ({placeholders})"
+        )
+        params.extend(decode_cursor(cursor, len(LISTING_SORT_KEY)))
+    else:
+        backwards = False
+
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += group_by
+
+    if order_by is not None:
+        sql += f" ORDER BY {order_by}"
+    else:
+        direction = "DESC" if backwards else "ASC"
+        sql += " ORDER BY " + ", ".join(
+            f"{column} {direction}" for column in LISTING_SORT_KEY
+        )
+
+    # Fetch one extra row to find out whether there is a next page.
+    sql += " LIMIT ?"
+    params.append(page_size + 1)
+    if cursor is None:
+        sql += " OFFSET ?"
+        params.append(page_size * (page - 1))
+
+    result = list(cast(Sequence[ListingBooksResult], db.query(sql, params)))
+    has_more = len(result) > page_size
+    result = result[:page_size]
+    if backwards:
+        result.reverse()
+
     books: list[CountBook] = []
-    for b in cast(Sequence[CountBooksResult], result):
+    for b in result:
         books.append(
             CountBook(
                 id=b["id"],
@@ -259,7 +464,123 @@ def get_books(page: int, page_size: int):
             )
         )
 
-    return books
+    prev_cursor: str | None = None
+    next_cursor: str | None = None
+    if result and order_by is None:
+        if backwards:
+            has_prev = has_more
+            has_next = True
+        else:
+            has_prev = cursor is not None or page > 1
+            has_next = has_more
+        if has_prev:
+            prev_cursor = _listing_cursor(result[0])
+        if has_next:
+            next_cursor = _listing_cursor(result[-1])
+
+    return BookPage(
+        books=books, prev_cursor=prev_cursor, next_cursor=next_cursor
+    )
+
+
+@cache.cached("books")
+def get_book_count() -> int:
+    sql = "SELECT COUNT(id) FROM books"
+    result = db.query(sql)
+    return result[0]["COUNT(id)"] if result else 0
+
+
+@cache.cached("authors", "books", "book_ownerships")
+def get_books(
+    page: int,
+    page_size: int,
+    cursor: str | None = None,
+    backwards: bool = False,
+) -> BookPage:
+    sql = f"""
+        SELECT
+            b.id,
+            b.isbn,
+            b.name,
+            bl.author,
+            c.label AS classification,
+            bl.owned_count AS total,
+            {LISTING_KEY_COLUMNS}
+        FROM books_listing AS bl
+        JOIN books AS b ON bl.book_id = b.id
+        JOIN classification AS c ON bl.class_id = c.id
+    """
+    return _paginate_listing(
+        sql, ["bl.owned_count > 0"], [], "", page, page_size, cursor, backwards
+    )
+
+
+@cache.cached("authors", "books", "book_ownerships")
+def get_books_in_class(
+    class_id: int,
+    page: int,
+    page_size: int,
+    cursor: str | None = None,
+    backwards: bool = False,
+) -> BookPage:
+    """
+    Returns the books in the subtree of the given class, i.e. the books
+    in the class and in all of its subclasses.
+    """
+    bounds = classification.get_index().subtree_range(class_id)
+    if bounds is None:
+        return BookPage(books=[], prev_cursor=None, next_cursor=None)
+
+    sql = f"""
+        SELECT
+            b.id,
+            b.isbn,
+            b.name,
+            bl.author,
+            c.label AS classification,
+            bl.owned_count AS total,
+            {LISTING_KEY_COLUMNS}
+        FROM books_listing AS bl
+        JOIN books AS b ON bl.book_id = b.id
+        JOIN classification AS c ON bl.class_id = c.id
+    """
+    return _paginate_listing(
+        sql,
+        ["bl.class_lft BETWEEN ? AND ?"],
+        [bounds[0], bounds[1]],
+        "",
+        page,
+        page_size,
+        cursor,
+        backwards,
+    )
+
+
+@cache.cached("books")
+def get_class_book_totals(class_ids: Sequence[int]) -> dict[int, int]:
+    """
+    Returns the number of books in the subtree of each of the given
+    classes. The totals are summed from the precomputed per-class counts.
+    """
+    if not class_ids:
+        return {}
+
+    placeholders = ", ".join("?" * len(class_ids))
+    sql = f"""
+        SELECT p.id, SUM(s.book_count) AS total
+        FROM classification AS p
+        JOIN classification AS c ON c.lft BETWEEN p.lft AND p.rgt
+        JOIN class_stats AS s ON c.id = s.class_id
+        WHERE p.id IN ({placeholders})
+        GROUP BY p.id
+    """
+    result = db.query(sql, class_ids)
+
+    totals = {id: 0 for id in class_ids}
+    for r in cast(Sequence[IDCountResult], result):
+        totals[r["id"]] = r["total"]
+
+    return totals
 
 
 def get_book_by_id(id: int) -> Book | None:
@@ -279,12 +600,96 @@ def get_book_by_id(id: int) -> Book | None:
     )
 
 
-def get_book_total_owned_count(book_id: int) -> int:
-    sql = "SELECT COUNT(id) AS total FROM book_ownerships WHERE book_id = ?"
-    result = db.query(sql, [book_id])
-    return result[0]["total"] if result else 0
+def get_book_page_data(
+    book_id: int, user_id: int | None
+) -> BookPageData | None:
+    """
+    Returns the data for the book page of the given book with a single
+    query. If `user_id` is None, the user-specific counts and flags are
+    zero and false.
+    """
+    sql = """
+        SELECT
+            b.id,
+            b.isbn,
+            b.name,
+            b.author_id,
+            b.class_id,
+            a.first_name,
+            a.surname,
+            IFNULL(
+                (SELECT owned_count FROM book_stats WHERE book_id = b.id), 0
+            ) AS total,
+            (
+                SELECT COUNT(o.id)
+                FROM book_ownerships AS o
+                WHERE o.book_id = b.id
+                    AND o.library_id IN (
+                        SELECT id FROM libraries WHERE user_id = ?
+                    )
+            ) AS user_total,
+            EXISTS(
+                SELECT 1
+                FROM read_books
+                WHERE user_id = ? AND book_id = b.id
+            ) AS has_read,
+            EXISTS(
+                SELECT 1
+                FROM reviews
+                WHERE user_id = ? AND book_id = b.id
+            ) AS has_left_review,
+            r.review_count,
+            r.star_sum,
+            r.stars_1,
+            r.stars_2,
+            r.stars_3,
+            r.stars_4,
+            r.stars_5
+        FROM books AS b
+        JOIN authors AS a ON b.author_id = a.id
+        LEFT JOIN book_ratings AS r ON b.id = r.book_id
+        WHERE b.id = ?
+    """
+    result = db.query(sql, [user_id, user_id, user_id, book_id])
+    if not result:
+        return None
+
+    r = cast(BookPageResult, result[0])
+    book_class = classification.get_index().get(r["class_id"])
+    if not book_class:
+        return None
+
+    return BookPageData(
+        book=Book(
+            id=r["id"],
+            isbn=r["isbn"],
+            name=r["name"],
+            author_id=r["author_id"],
+            class_id=r["class_id"],
+        ),
+        author=author.Author(
+            id=r["author_id"], first_name=r["first_name"], surname=r["surname"]
+        ),
+        book_class=book_class,
+        total_count=r["total"],
+        user_count=r["user_total"],
+        has_read=r["has_read"] == 1,
+        has_left_review=r["has_left_review"] == 1,
+        rating=BookRating(
+            count=r["review_count"] or 0,
+            star_sum=r["star_sum"] or 0,
+            histogram=[
+                r["stars_1"] or 0,
+                r["stars_2"] or 0,
+                r["stars_3"] or 0,
+                r["stars_4"] or 0,
+                r["stars_5"] or 0,
+            ],
+        ),
+    )
 
 
+@cache.cached("book_ownerships")
 def get_user_book_count(user_id: int) -> int:
     sql = """
         SELECT COUNT(DISTINCT o.book_id) AS total
@@ -296,6 +701,7 @@ def get_user_book_count(user_id: int) -> int:
     return result[0]["total"] if result else 0
 
 
+@cache.cached("read_books")
 def get_user_read_book_count(user_id: int) -> int:
     sql = """
         SELECT COUNT(DISTINCT r.book_id) AS total
@@ -306,28 +712,52 @@ def get_user_read_book_count(user_id: int) -> int:
     return result[0]["total"] if result else 0
 
 
-def get_user_grand_total_books(user_id: int) -> int:
-    sql = """
-        SELECT COUNT(o.id) AS total
-        FROM book_ownerships AS o
-        JOIN libraries AS l ON o.library_id = l.id
-        WHERE l.user_id = ?
+def get_book_version(book_id: int) -> int:
+    """
+    Returns the version of the data shown on the page of the book. See
+    migrations/013_create_page_versions_tables.sql.
     """
+    sql = "SELECT version FROM book_versions WHERE book_id = ?"
+    result = db.query(sql, [book_id])
+    return result[0]["version"] if result else 0
+
+
+def get_user_version(user_id: int) -> int:
+    """
+    Returns the version of the books and the read books of the user.
+    """
+    sql = "SELECT version FROM user_versions WHERE user_id = ?"
     result = db.query(sql, [user_id])
-    return result[0]["total"] if result else 0
+    return result[0]["version"] if result else 0
 
 
-def get_book_user_owned_count(book_id: int, user_id: int) -> int:
+def get_user_version_by_name(username: str) -> int | None:
+    """
+    Returns the version of the books and the read books of the user with
+    the given username, or None if there is no such user.
+    """
+    sql = """
+        SELECT IFNULL(v.version, 0) AS version
+        FROM users AS u
+        LEFT JOIN user_versions AS v ON u.id = v.user_id
+        WHERE u.username = ?
+    """
+    result = db.query(sql, [username])
+    return result[0]["version"] if result else None
+
+
+def get_user_grand_total_books(user_id: int) -> int:
     sql = """
         SELECT COUNT(o.id) AS total
         FROM book_ownerships AS o
         JOIN libraries AS l ON o.library_id = l.id
-        WHERE o.book_id = ? AND l.user_id = ?
+        WHERE l.user_id = ?
     """
-    result = db.query(sql, [book_id, user_id])
+    result = db.query(sql, [user_id])
     return result[0]["total"] if result else 0
 
 
+@cache.cached("authors", "books", "book_ownerships")
 def get_popular_books(count: int) -> Sequence[CountBook]:
     sql = """
         SELECT
@@ -336,13 +766,13 @@ def get_popular_books(count: int) -> Sequence[CountBook]:
             b.name,
             IFNULL(a.first_name, '') || ' ' || a.surname AS author,
             c.label AS classification,
-            COUNT(o.id) AS total
-        FROM books AS b
-        JOIN book_ownerships AS o ON b.id = o.book_id
+            s.owned_count AS total
+        FROM book_stats AS s
+        JOIN books AS b ON s.book_id = b.id
         JOIN authors AS a ON b.author_id = a.id
         JOIN classification AS c ON b.class_id = c.id
-        GROUP BY b.id
-        ORDER BY total DESC, c.key ASC, author ASC, b.name ASC
+        WHERE s.owned_count > 0
+        ORDER BY s.owned_count DESC, s.book_id ASC
         LIMIT ?
     """
     result = db.query(sql, [count])
@@ -409,208 +839,135 @@ def get_owned_books(user_id: int) -> Sequence[CountBook]:
     return books
 
 
-def get_read_books(user_id: int) -> Sequence[JointBook]:
-    """
-    Returns the books read by the given user.
-    """
-    sql = """
-        SELECT
-            b.id,
-            b.isbn,
-            b.name,
-            IFNULL(a.first_name, '') || ' ' || a.surname AS author,
-            c.label AS classification
-        FROM books AS b
-        JOIN read_books AS r ON b.id = r.book_id
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
-        WHERE r.user_id = ?
-        ORDER BY
-            c.key ASC,
-            a.surname ASC,
-            a.first_name ASC,
-            b.name ASC,
-            c.key ASC,
-            c.label ASC
-    """
-
-    result = db.query(sql, [user_id])
-
-    books: list[JointBook] = []
-    for b in cast(Sequence[CountBooksResult], result):
-        books.append(
-            JointBook(
-                id=b["id"],
-                isbn=b["isbn"],
-                name=b["name"],
-                author=b["author"],
-                classification=b["classification"],
-            )
-        )
-
-    return books
-
-
 def get_read_books_paginated(
-    user_id: int, page: int, page_size: int
-) -> Sequence[CountBook]:
+    user_id: int,
+    page: int,
+    page_size: int,
+    cursor: str | None = None,
+    backwards: bool = False,
+) -> BookPage:
     """
     Returns the books read by the given user.
     """
-    sql = """
+    sql = f"""
         SELECT
             b.id,
             b.isbn,
             b.name,
-            IFNULL(a.first_name, '') || ' ' || a.surname AS author,
+            bl.author,
             c.label AS classification,
-            COUNT(o.id) AS total
+            bl.owned_count AS total,
+            {LISTING_KEY_COLUMNS}
         FROM books AS b
         JOIN read_books AS r ON b.id = r.book_id
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
-        JOIN book_ownerships AS o ON b.id = o.book_id
-        WHERE r.user_id = ?
-        GROUP BY
-            b.id,
-            b.isbn,
-            b.name,
-            author,
-            classification
-        ORDER BY
-            c.key ASC,
-            a.surname ASC,
-            a.first_name ASC,
-            b.name ASC,
-            c.key ASC,
-            c.label ASC,
-            total DESC
-        LIMIT ? OFFSET ?
+        JOIN books_listing AS bl ON b.id = bl.book_id
+        JOIN classification AS c ON bl.class_id = c.id
     """
-    limit = page_size
-    offset = page_size * (page - 1)
-    result = db.query(sql, [user_id, limit, offset])
-    books: list[CountBook] = []
-    for b in cast(Sequence[CountBooksResult], result):
-        books.append(
-            CountBook(
-                id=b["id"],
-                isbn=b["isbn"],
-                name=b["name"],
-                author=b["author"],
-                classification=b["classification"],
-                count=b["total"],
-            )
-        )
-
-    return books
+    return _paginate_listing(
+        sql,
+        ["r.user_id = ?", "bl.owned_count > 0"],
+        [user_id],
+        " GROUP BY b.id",
+        page,
+        page_size,
+        cursor,
+        backwards,
+    )
 
 
 def get_owned_books_paginated(
-    user_id: int, page: int, page_size: int
-) -> Sequence[CountBook]:
+    user_id: int,
+    page: int,
+    page_size: int,
+    cursor: str | None = None,
+    backwards: bool = False,
+) -> BookPage:
     """
     Returns the books owned by the given user.
     """
-    sql = """
+    sql = f"""
         SELECT
             b.id,
             b.isbn,
             b.name,
-            IFNULL(a.first_name, '') || ' ' || a.surname AS author,
+            bl.author,
             c.label AS classification,
-            COUNT(o.id) AS total
+            COUNT(o.id) AS total,
+            {LISTING_KEY_COLUMNS}
         FROM books AS b
         JOIN book_ownerships AS o ON b.id = o.book_id
         JOIN libraries AS l ON o.library_id = l.id
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
-        WHERE l.user_id = ?
-        GROUP BY
-            b.id,
-            b.isbn,
-            b.name,
-            author,
-            classification
-        ORDER BY
-            c.key ASC,
-            a.surname ASC,
-            a.first_name ASC,
-            b.name ASC,
-            c.key ASC,
-            c.label ASC,
-            total DESC
-        LIMIT ? OFFSET ?
+        JOIN books_listing AS bl ON b.id = bl.book_id
+        JOIN classification AS c ON bl.class_id = c.id
     """
-    limit = page_size
-    offset = page_size * (page - 1)
-    result = db.query(sql, [user_id, limit, offset])
-    books: list[CountBook] = []
-    for b in cast(Sequence[CountBooksResult], result):
-        books.append(
-            CountBook(
-                id=b["id"],
-                isbn=b["isbn"],
-                name=b["name"],
-                author=b["author"],
-                classification=b["classification"],
-                count=b["total"],
-            )
-        )
-
-    return books
+    return _paginate_listing(
+        sql,
+        ["l.user_id = ?"],
+        [user_id],
+        " GROUP BY b.id",
+        page,
+        page_size,
+        cursor,
+        backwards,
+    )
 
 
-def get_owned_book_counts_by_id(user_id: int) -> Sequence[BookIDCounts]:
+def get_owned_counts_for_books(
+    user_id: int, book_ids: Sequence[int]
+) -> dict[int, int]:
     """
-    Returns the book IDs of the books owned by the given user.
-    """
-    sql = """
-        SELECT b.id, COUNT(o.id) AS total
-        FROM books AS b
-        JOIN book_ownerships AS o ON b.id = o.book_id
-        JOIN libraries AS l ON o.library_id = l.id
-        WHERE l.user_id = ?
-        GROUP BY b.id
+    Returns the number of copies the given user owns of each of the given
+    books. Only the books the user owns are included, so the result can
+    be used to check the ownership of the books on a listing page.
     """
+    if not book_ids:
+        return {}
 
-    result = db.query(sql, [user_id])
-
-    books: list[BookIDCounts] = []
-    for b in cast(Sequence[IDCountResult], result):
-        books.append(BookIDCounts(id=b["id"], count=b["total"]))
+    placeholders = ", ".join("?" * len(book_ids))
+    sql = f"""
+        SELECT o.book_id AS id, COUNT(o.id) AS total
+        FROM book_ownerships AS o
+        WHERE o.library_id IN (SELECT id FROM libraries WHERE user_id = ?)
+            AND o.book_id IN ({placeholders})
+        GROUP BY o.book_id
+    """
+    result = db.query(sql, [user_id, *book_ids])
 
-    return books
+    return {r["id"]: r["total"] for r in cast(Sequence[IDCountResult], result)}
 
 
-def is_owner(user_id: int, book_id: int) -> bool:
+def get_read_book_ids(user_id: int, book_ids: Sequence[int]) -> set[int]:
     """
-    Checks whether the given user owns a copy of the given book.
+    Returns the IDs of the books that the given user has read out of the
+    given books.
     """
-    sql = """
-        SELECT COUNT(o.id) AS count
-        FROM book_ownerships AS o, libraries AS l
-        WHERE o.library_id = l.id AND l.user_id = ? AND o.book_id = ?
+    if not book_ids:
+        return set()
+
+    placeholders = ", ".join("?" * len(book_ids))
+    sql = f"""
+        SELECT DISTINCT book_id
+        FROM read_books
+        WHERE user_id = ? AND book_id IN ({placeholders})
     """
-    result = db.query(sql, [user_id, book_id])
+    result = db.query(sql, [user_id, *book_ids])
 
-    return result[0]["count"] > 0 if result else False
+    return {cast(int, r["book_id"]) for r in result}
 
 
-def is_read(user_id: int, book_id: int) -> bool:
+def is_owner(user_id: int, book_id: int) -> bool:
     """
-    Returns whether the given use has read the book.
+    Checks whether the given user owns a copy of the given book.
     """
     sql = """
-        SELECT EXISTS(
-            SELECT 1
-            FROM read_books
-            WHERE user_id = ? AND book_id = ?
-        ) AS result
+        SELECT COUNT(o.id) AS count
+        FROM book_ownerships AS o
+        WHERE o.library_id IN (SELECT id FROM libraries WHERE user_id = ?)
+            AND o.book_id = ?
     """
     result = db.query(sql, [user_id, book_id])
 
-    return cast(int, result[0]["result"]) == 1
+    return result[0]["count"] > 0 if result else False
 
 
 def search_books_from_author(author_id: int, book_name: str):
@@ -636,22 +993,13 @@ def search_books_from_author(author_id: int, book_name: str):
     return books
 
 
-def get_classification_by_id(id: int) -> LibraryClass | None:
-    sql = "SELECT id, key, label FROM classification WHERE id = ?"
-    result = db.query(sql, [id])
-
-    return (
-        LibraryClass(
-            id=cast(int, result[0]["id"]),
-            key=cast(str, result[0]["key"]),
-            label=cast(str, result[0]["label"]),
-        )
-        if result
-        else None
-    )
+def get_classification_by_id(id: int) -> classification.LibraryClass | None:
+    return classification.get_index().get(id)
 
 
-def search_classification(search: str) -> Sequence[LibraryClass]:
+def search_classification(
+    search: str,
+) -> Sequence[classification.LibraryClass]:
     if not search:
         return []
     search_queries: list[str] = []
@@ -671,120 +1019,153 @@ def search_classification(search: str) -> Sequence[LibraryClass]:
 
     search_queries.extend(parts[1:])
 
-    sql = "SELECT id, key, label FROM classification WHERE"
-    if key:
-        sql += " key LIKE ?"
-        if search_queries:
-            sql += " OR"
-
-    if search_queries:
-        label_query = ""
-        for i in range(len(search_queries)):
-            if i == 0:
-                label_query += " label LIKE ?"
-            else:
-                label_query += " OR label LIKE ?"
-        sql += label_query
-
-    params: list[str] = []
-    if key:
-        params.append(f"%{key}%")
-
-    for s in search_queries:
-        params.append(f"%{s}%")
-
-    result = db.query(sql, params)
-
-    classes: list[LibraryClass] = []
-    for c in cast(Sequence[LibraryClassResult], result):
-        classes.append(
-            LibraryClass(id=c["id"], key=c["key"], label=c["label"])
-        )
+    return classification.get_index().search(key, search_queries)
 
-    return classes
 
+# The weights of the name, ISBN and author columns of the search index
+# when the search results are ranked.
+SEARCH_RANK = "bm25(book_search, 10.0, 2.0, 5.0)"
 
-def search(
-    page: int,
-    page_size: int,
+
+def fts_query(columns: str, text: str) -> str | None:
+    """
+    Builds a full-text search query that matches the rows that contain
+    a word starting with each of the words in the given text in the
+    given columns. The words are quoted so that the user input cannot
+    contain any query syntax.
+    """
+    words = ['"' + w.replace('"', '""') + '"*' for w in text.split()]
+    if not words:
+        return None
+    return f"{columns} : ({' AND '.join(words)})"
+
+
+def _search_conditions(
     isbn: str | None,
     name: str | None,
     author: str | None,
     classification: str | None,
-):
-    sql = """
-        SELECT
-            b.id,
-            b.isbn,
-            b.name,
-            IFNULL(a.first_name, '') || ' ' || a.surname AS author,
-            c.label AS classification,
-            COUNT(o.id) AS total
-        FROM books AS b
-        JOIN book_ownerships AS o ON b.id = o.book_id
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
+) -> tuple[str | None, list[str], list[str | int]]:
     """
-
-    if isbn or name or author or classification:
-        sql += "WHERE "
+    Returns the full-text query for the book search index and the other
+    conditions and parameters for searching the books.
+    """
+    book_queries: list[str] = []
+    for column, text in (("isbn", isbn), ("name", name), ("author", author)):
+        if text:
+            q = fts_query(column, text)
+            if q:
+                book_queries.append(q)
 
     query: list[str] = []
     params: list[str | int] = []
-    if isbn:
-        query.append("b.isbn LIKE ?")
-        params.append(f"%{isbn}%")
+    if classification:
+        q = fts_query("{key label words}", classification)
+        if q:
+            query.append(
+                """b.class_id IN (
+                    SELECT rowid FROM class_search WHERE class_search MATCH ?
+                )"""
+            )
+            params.append(q)
 
-    if name:
-        query.append("b.name LIKE ?")
-        params.append(f"%{name}%")
+    return (
+        " AND ".join(book_queries) if book_queries else None,
+        query,
+        params,
+    )
 
-    if author:
-        parts = author.split()
-        for p in parts:
-            query.append("(a.first_name LIKE ? OR a.surname LIKE ?)")
-            params.append(p)
-            params.append(p)
 
-    if classification:
-        parts = classification.split()
-        for p in parts:
-            query.append("(c.key LIKE ? OR c.label LIKE ?)")
-            params.append(p)
-            params.append(p)
-
-    sql += (
-        " AND ".join(query)
-        + """GROUP BY b.id
-        ORDER BY
-            c.key ASC,
-            a.surname ASC,
-            a.first_name ASC,
-            b.name ASC,
-            classification ASC,
-            total DESC
-        LIMIT ? OFFSET ?
+@cache.cached("authors", "books", "book_ownerships")
+def search(
+    page: int,
+    page_size: int,
+    isbn: str | None,
+    name: str | None,
+    author: str | None,
+    classification: str | None,
+    cursor: str | None = None,
+    backwards: bool = False,
+    ranked: bool = False,
+) -> BookPage:
     """
+    Searches the books using the full-text search indexes. The results
+    are in the listing order, or ranked by their relevance if `ranked`
+    is set and the search has terms for the book search index.
+    """
+    match, query, params = _search_conditions(
+        isbn, name, author, classification
     )
-    limit = page_size
-    offset = page_size * (page - 1)
-    params.append(limit)
-    params.append(offset)
-    result = db.query(sql, params)
-    books: list[CountBook] = []
-    for b in cast(Sequence[CountBooksResult], result):
-        books.append(
-            CountBook(
-                id=b["id"],
-                isbn=b["isbn"],
-                name=b["name"],
-                author=b["author"],
-                classification=b["classification"],
-                count=b["total"],
+    query.append("bl.owned_count > 0")
+
+    order_by: str | None = None
+    if ranked and match:
+        sql = f"""
+            SELECT
+                b.id,
+                b.isbn,
+                b.name,
+                bl.author,
+                c.label AS classification,
+                bl.owned_count AS total,
+                {LISTING_KEY_COLUMNS}
+            FROM book_search
+            JOIN books AS b ON book_search.rowid = b.id
+            JOIN books_listing AS bl ON b.id = bl.book_id
+            JOIN classification AS c ON bl.class_id = c.id
+        """
+        query.insert(0, "book_search MATCH ?")
+        params.insert(0, match)
+        order_by = f"{SEARCH_RANK} ASC, b.id ASC"
+    else:
+        sql = f"""
+            SELECT
+                b.id,
+                b.isbn,
+                b.name,
+                bl.author,
+                c.label AS classification,
+                bl.owned_count AS total,
+                {LISTING_KEY_COLUMNS}
+            FROM books_listing AS bl
+            JOIN books AS b ON bl.book_id = b.id
+            JOIN classification AS c ON bl.class_id = c.id
+        """
+        if match:
+            query.insert(
+                0,
+                """b.id IN (
+                    SELECT rowid FROM book_search WHERE book_search MATCH ?
+                )""",
             )
-        )
+            params.insert(0, match)
+
+    return _paginate_listing(
+        sql, query, params, "", page, page_size, cursor, backwards, order_by
+    )
+
+
+# Searches count at most this many results by default. The search page
+# shows that there are more results than that instead of the exact count,
+# so a broad search doesn't have to go through every match only to count
+# the pages.
+SEARCH_COUNT_LIMIT = 1000
+
+
+def search_count_limit(page: int, page_size: int) -> int:
+    """
+    Returns the limit for counting the results of a search so that the
+    count reaches the given page. The limit is rounded up to a multiple
+    of SEARCH_COUNT_LIMIT, so the nearby pages share the cached count.
+    """
+    pages = max(1, math.ceil(page * page_size / SEARCH_COUNT_LIMIT))
+    return pages * SEARCH_COUNT_LIMIT
 
-    return books
+
+def _normalize_search(text: str | None) -> str | None:
+    # The full-text search is not case-sensitive and it splits the text
+    # into words, so the case and the spacing don't change the results.
+    return " ".join(text.lower().split()) if text else None
 
 
 def search_result_count(
@@ -792,50 +1173,74 @@ def search_result_count(
     name: str | None,
     author: str | None,
     classification: str | None,
-) -> int:
-    sql = """
-        SELECT COUNT(b.id)
-        FROM books AS b
-        JOIN authors AS a ON b.author_id = a.id
-        JOIN classification AS c ON b.class_id = c.id
+    limit: int = SEARCH_COUNT_LIMIT,
+) -> ResultCount:
     """
+    Counts the results of a search up to the given limit. The counts are
+    cached by the normalized search, so the same search with different
+    capitalization or spacing uses the same count.
+    """
+    return _count_search_results(
+        _normalize_search(isbn),
+        _normalize_search(name),
+        _normalize_search(author),
+        _normalize_search(classification),
+        limit,
+    )
 
-    if isbn or name or author or classification:
-        sql += "WHERE "
-
-    query: list[str] = []
-    params: list[str | int] = []
-    if isbn:
-        query.append("b.isbn LIKE ?")
-        params.append(f"%{isbn}%")
-
-    if name:
-        query.append("b.name LIKE ?")
-        params.append(f"%{name}%")
-
-    if author:
-        parts = author.split()
-        for p in parts:
-            query.append("(a.first_name LIKE ? OR a.surname LIKE ?)")
-            params.append(p)
-            params.append(p)
 
-    if classification:
-        parts = classification.split()
-        for p in parts:
-            query.append("(c.key LIKE ? OR c.label LIKE ?)")
-            params.append(p)
-            params.append(p)
+@cache.cached("authors", "books", "book_ownerships")
+def _count_search_results(
+    isbn: str | None,
+    name: str | None,
+    author: str | None,
+    classification: str | None,
+    limit: int,
+) -> ResultCount:
+    match, query, params = _search_conditions(
+        isbn, name, author, classification
+    )
+    # Only the books that someone owns are counted, the same as the
+    # results of search(). The count goes through the full-text matches
+    # in the order of the index, so it can stop once the limit is reached.
+    query.append("s.owned_count > 0")
+    if match:
+        sql = """
+            SELECT 1
+            FROM book_search
+            JOIN books AS b ON book_search.rowid = b.id
+            JOIN book_stats AS s ON b.id = s.book_id
+        """
+        query.insert(0, "book_search MATCH ?")
+        params.insert(0, match)
+    else:
+        sql = """
+            SELECT 1
+            FROM book_stats AS s
+            JOIN books AS b ON s.book_id = b.id
+        """
+    sql += " WHERE " + " AND ".join(query)
+    result = db.query(
+        f"SELECT COUNT(*) AS total FROM ({sql} LIMIT ?)", [*params, limit + 1]
+    )
+    total = result[0]["total"] if result else 0
+    if total > limit:
+        return ResultCount(count=limit, exact=False)
+    return ResultCount(count=total, exact=True)
 
-    sql += " AND ".join(query)
-    result = db.query(sql, params)
 
-    return result[0]["COUNT(b.id)"] if result else 0
+def _decode_timestamp(timestamp: int) -> datetime:
+    # The times of the reviews are stored as Unix timestamps in UTC.
+    return datetime.fromtimestamp(timestamp, timezone.utc)
 
 
-def get_reviews(book_id: int) -> Sequence[Review]:
+def get_reviews(
+    book_id: int, page_size: int, cursor: str | None = None
+) -> ReviewPage:
     """
-    Returns the reviews for a book.
+    Returns a page of the reviews for a book, the most recently edited
+    first. The next pages are fetched with the cursor of the previous
+    page so that only the reviews on the page are read.
     """
     sql = """
         SELECT
@@ -849,35 +1254,38 @@ def get_reviews(book_id: int) -> Sequence[Review]:
             r.last_edited
         FROM reviews AS r
         JOIN users AS u ON u.id = r.user_id
-        JOIN books AS b ON b.id = r.book_id
         WHERE r.book_id = ?
-        ORDER BY r.last_edited DESC, r.time DESC, username ASC
     """
-    result = db.query(sql, [book_id])
+    params: list[str | int] = [book_id]
+    if cursor is not None:
+        sql += " AND (r.last_edited, r.id) < (?, ?)"
+        params.extend(decode_cursor(cursor, 2))
+    sql += " ORDER BY r.last_edited DESC, r.id DESC LIMIT ?"
+    params.append(page_size + 1)
+    result = cast(Sequence[ReviewResult], db.query(sql, params))
+
+    next_cursor: str | None = None
+    if len(result) > page_size:
+        result = result[:page_size]
+        next_cursor = encode_cursor(
+            [result[-1]["last_edited"], result[-1]["id"]]
+        )
 
     reviews: list[Review] = []
-    for r in cast(Sequence[ReviewResult], result):
-        try:
-            reviews.append(
-                Review(
-                    id=r["id"],
-                    user=users.User(id=r["user_id"], username=r["username"]),
-                    book_id=r["book_id"],
-                    stars=r["stars"],
-                    msg=r["message"],
-                    timestamp=datetime.strptime(
-                        r["time"], "%Y-%m-%d %H:%M:%S"
-                    ),
-                    last_edited=datetime.strptime(
-                        r["last_edited"], "%Y-%m-%d %H:%M:%S"
-                    ),
-                )
+    for r in result:
+        reviews.append(
+            Review(
+                id=r["id"],
+                user=users.User(id=r["user_id"], username=r["username"]),
+                book_id=r["book_id"],
+                stars=r["stars"],
+                msg=r["message"],
+                timestamp=_decode_timestamp(r["time"]),
+                last_edited=_decode_timestamp(r["last_edited"]),
             )
-        except ValueError:
-            print("Invalid time format found in the database")
-            abort(500)
+        )
 
-    return reviews
+    return ReviewPage(reviews=reviews, next_cursor=next_cursor)
 
 
 def get_user_review(book_id: int, user_id: int) -> Review | None:
@@ -904,21 +1312,15 @@ def get_user_review(book_id: int, user_id: int) -> Review | None:
     review: Review | None = None
     if result:
         r = cast(ReviewResult, result[0])
-        try:
-            review = Review(
-                id=r["id"],
-                user=users.User(id=r["user_id"], username=r["username"]),
-                book_id=r["book_id"],
-                stars=r["stars"],
-                msg=r["message"],
-                timestamp=datetime.strptime(r["time"], "%Y-%m-%d %H:%M:%S"),
-                last_edited=datetime.strptime(
-                    r["last_edited"], "%Y-%m-%d %H:%M:%S"
-                ),
-            )
-        except ValueError:
-            print("Invalid time format found in the database")
-            abort(500)
+        review = Review(
+            id=r["id"],
+            user=users.User(id=r["user_id"], username=r["username"]),
+            book_id=r["book_id"],
+            stars=r["stars"],
+            msg=r["message"],
+            timestamp=_decode_timestamp(r["time"]),
+            last_edited=_decode_timestamp(r["last_edited"]),
+        )
 
     return review
 
@@ -0,0 +1,49 @@
+BEGIN TRANSACTION;
+
+-- The table book_stats holds the precomputed statistics for the books so
+-- that the listings don't have to aggregate book_ownerships on every
+-- request. The rows are maintained by the triggers below.
+CREATE TABLE IF NOT EXISTS book_stats (
+  book_id INTEGER PRIMARY KEY,
+  owned_count INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY(book_id) REFERENCES books(id)
+);
+
+-- Serves the "popular books" listing as a top-N lookup.
+CREATE INDEX IF NOT EXISTS book_stats_owned_count_index
+ON book_stats (owned_count DESC, book_id ASC);
+
+INSERT OR REPLACE INTO book_stats (book_id, owned_count)
+SELECT book_id, COUNT(id)
+FROM book_ownerships
+GROUP BY book_id;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_insert_stats
+AFTER INSERT ON book_ownerships
+BEGIN
+  INSERT INTO book_stats (book_id, owned_count)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET owned_count = owned_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_delete_stats
+AFTER DELETE ON book_ownerships
+BEGIN
+  UPDATE book_stats
+  SET owned_count = owned_count - 1
+  WHERE book_id = OLD.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_update_stats
+AFTER UPDATE OF book_id ON book_ownerships
+WHEN NEW.book_id != OLD.book_id
+BEGIN
+  UPDATE book_stats
+  SET owned_count = owned_count - 1
+  WHERE book_id = OLD.book_id;
+  INSERT INTO book_stats (book_id, owned_count)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET owned_count = owned_count + 1;
+END;
+
+COMMIT;
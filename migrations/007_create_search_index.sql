@@ -0,0 +1,94 @@
+BEGIN TRANSACTION;
+
+-- The table book_search is the full-text search index for the books. The
+-- rowid of a row is the ID of the book, and the author's name is
+-- denormalized into the index so that the searches don't need to join
+-- authors. Diacritics are kept as "ä" and "ö" are separate letters in
+-- Finnish.
+CREATE VIRTUAL TABLE IF NOT EXISTS book_search USING fts5(
+  name,
+  isbn,
+  author,
+  tokenize = "unicode61 remove_diacritics 0",
+  prefix = '2 3'
+);
+
+-- The table class_search is the full-text search index for the
+-- classification. The rowid of a row is the ID of the class. The classes
+-- are indexed separately from the books as the classification is small and
+-- static, and the matching classes can be used to find the books by their
+-- class ID. The dots are kept in the tokens so that the keys, for example
+-- "84.2", are indexed as single tokens.
+CREATE VIRTUAL TABLE IF NOT EXISTS class_search USING fts5(
+  key,
+  label,
+  words,
+  tokenize = "unicode61 remove_diacritics 0 tokenchars '.'"
+);
+
+-- The index is needed for updating the search index when an author is
+-- updated.
+CREATE INDEX IF NOT EXISTS book_author_id_index ON books (author_id);
+
+DELETE FROM book_search;
+
+INSERT INTO book_search (rowid, name, isbn, author)
+SELECT
+  b.id,
+  b.name,
+  b.isbn,
+  IFNULL(a.first_name || ' ', '') || a.surname
+FROM books AS b
+JOIN authors AS a ON b.author_id = a.id;
+
+DELETE FROM class_search;
+
+INSERT INTO class_search (rowid, key, label, words)
+SELECT
+  c.id,
+  c.key,
+  c.label,
+  (
+    SELECT group_concat(w.word, ' ')
+    FROM class_index_words AS w
+    WHERE w.class_id = c.id
+  )
+FROM classification AS c;
+
+CREATE TRIGGER IF NOT EXISTS books_insert_search
+AFTER INSERT ON books
+BEGIN
+  INSERT INTO book_search (rowid, name, isbn, author)
+  SELECT NEW.id, NEW.name, NEW.isbn, IFNULL(a.first_name || ' ', '') || a.surname
+  FROM authors AS a
+  WHERE a.id = NEW.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_update_search
+AFTER UPDATE OF name, isbn, author_id ON books
+BEGIN
+  DELETE FROM book_search WHERE rowid = OLD.id;
+  INSERT INTO book_search (rowid, name, isbn, author)
+  SELECT NEW.id, NEW.name, NEW.isbn, IFNULL(a.first_name || ' ', '') || a.surname
+  FROM authors AS a
+  WHERE a.id = NEW.author_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_delete_search
+AFTER DELETE ON books
+BEGIN
+  DELETE FROM book_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS authors_update_search
+AFTER UPDATE OF first_name, surname ON authors
+BEGIN
+  DELETE FROM book_search
+  WHERE rowid IN (SELECT id FROM books WHERE author_id = NEW.id);
+  INSERT INTO book_search (rowid, name, isbn, author)
+  SELECT b.id, b.name, b.isbn, IFNULL(NEW.first_name || ' ', '') || NEW.surname
+  FROM books AS b
+  WHERE b.author_id = NEW.id;
+END;
+
+COMMIT;
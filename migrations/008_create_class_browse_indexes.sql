@@ -0,0 +1,55 @@
+BEGIN TRANSACTION;
+
+-- These indexes are needed for finding the books in a subtree of the
+-- classification: the classes of the subtree are found by their nested set
+-- boundaries, and the books by their class.
+CREATE INDEX IF NOT EXISTS classification_lft_rgt_index
+ON classification (lft, rgt);
+
+CREATE INDEX IF NOT EXISTS book_class_id_index ON books (class_id);
+
+-- The table class_stats holds the number of books in each class, not
+-- including the subclasses. The total for a branch of the classification is
+-- the sum over the classes of the branch, which is cheap as there are only
+-- some tens of thousands of classes in total. The rows are maintained by
+-- the triggers below.
+CREATE TABLE IF NOT EXISTS class_stats (
+  class_id INTEGER PRIMARY KEY,
+  book_count INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY(class_id) REFERENCES classification(id)
+);
+
+INSERT OR REPLACE INTO class_stats (class_id, book_count)
+SELECT class_id, COUNT(id)
+FROM books
+GROUP BY class_id;
+
+CREATE TRIGGER IF NOT EXISTS books_insert_class_stats
+AFTER INSERT ON books
+BEGIN
+  INSERT INTO class_stats (class_id, book_count)
+  VALUES (NEW.class_id, 1)
+  ON CONFLICT (class_id) DO UPDATE SET book_count = book_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_delete_class_stats
+AFTER DELETE ON books
+BEGIN
+  UPDATE class_stats
+  SET book_count = book_count - 1
+  WHERE class_id = OLD.class_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_update_class_stats
+AFTER UPDATE OF class_id ON books
+WHEN NEW.class_id != OLD.class_id
+BEGIN
+  UPDATE class_stats
+  SET book_count = book_count - 1
+  WHERE class_id = OLD.class_id;
+  INSERT INTO class_stats (class_id, book_count)
+  VALUES (NEW.class_id, 1)
+  ON CONFLICT (class_id) DO UPDATE SET book_count = book_count + 1;
+END;
+
+COMMIT;
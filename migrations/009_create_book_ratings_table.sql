@@ -0,0 +1,135 @@
+BEGIN TRANSACTION;
+
+-- The table book_ratings holds the aggregated ratings of the books so that
+-- the book page does not have to read all of the reviews for showing the
+-- average rating. The rows are maintained by the triggers below.
+CREATE TABLE IF NOT EXISTS book_ratings (
+  book_id INTEGER PRIMARY KEY,
+  review_count INTEGER NOT NULL DEFAULT 0,
+  star_sum INTEGER NOT NULL DEFAULT 0,
+  stars_1 INTEGER NOT NULL DEFAULT 0,
+  stars_2 INTEGER NOT NULL DEFAULT 0,
+  stars_3 INTEGER NOT NULL DEFAULT 0,
+  stars_4 INTEGER NOT NULL DEFAULT 0,
+  stars_5 INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY(book_id) REFERENCES books(id)
+);
+
+-- Serves the pages of the reviews of a book, newest first.
+CREATE INDEX IF NOT EXISTS review_book_last_edited_index
+ON reviews (book_id, last_edited DESC, id DESC);
+
+INSERT OR REPLACE INTO book_ratings (
+  book_id,
+  review_count,
+  star_sum,
+  stars_1,
+  stars_2,
+  stars_3,
+  stars_4,
+  stars_5
+)
+SELECT
+  book_id,
+  COUNT(id),
+  SUM(stars),
+  SUM(stars = 1),
+  SUM(stars = 2),
+  SUM(stars = 3),
+  SUM(stars = 4),
+  SUM(stars = 5)
+FROM reviews
+GROUP BY book_id;
+
+CREATE TRIGGER IF NOT EXISTS reviews_insert_ratings
+AFTER INSERT ON reviews
+BEGIN
+  INSERT INTO book_ratings (
+    book_id,
+    review_count,
+    star_sum,
+    stars_1,
+    stars_2,
+    stars_3,
+    stars_4,
+    stars_5
+  )
+  VALUES (
+    NEW.book_id,
+    1,
+    NEW.stars,
+    NEW.stars = 1,
+    NEW.stars = 2,
+    NEW.stars = 3,
+    NEW.stars = 4,
+    NEW.stars = 5
+  )
+  ON CONFLICT (book_id) DO UPDATE SET
+    review_count = review_count + 1,
+    star_sum = star_sum + excluded.star_sum,
+    stars_1 = stars_1 + excluded.stars_1,
+    stars_2 = stars_2 + excluded.stars_2,
+    stars_3 = stars_3 + excluded.stars_3,
+    stars_4 = stars_4 + excluded.stars_4,
+    stars_5 = stars_5 + excluded.stars_5;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_ratings
+AFTER DELETE ON reviews
+BEGIN
+  UPDATE book_ratings
+  SET
+    review_count = review_count - 1,
+    star_sum = star_sum - OLD.stars,
+    stars_1 = stars_1 - (OLD.stars = 1),
+    stars_2 = stars_2 - (OLD.stars = 2),
+    stars_3 = stars_3 - (OLD.stars = 3),
+    stars_4 = stars_4 - (OLD.stars = 4),
+    stars_5 = stars_5 - (OLD.stars = 5)
+  WHERE book_id = OLD.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_ratings
+AFTER UPDATE OF stars, book_id ON reviews
+BEGIN
+  UPDATE book_ratings
+  SET
+    review_count = review_count - 1,
+    star_sum = star_sum - OLD.stars,
+    stars_1 = stars_1 - (OLD.stars = 1),
+    stars_2 = stars_2 - (OLD.stars = 2),
+    stars_3 = stars_3 - (OLD.stars = 3),
+    stars_4 = stars_4 - (OLD.stars = 4),
+    stars_5 = stars_5 - (OLD.stars = 5)
+  WHERE book_id = OLD.book_id;
+  INSERT INTO book_ratings (
+    book_id,
+    review_count,
+    star_sum,
+    stars_1,
+    stars_2,
+    stars_3,
+    stars_4,
+    stars_5
+  )
+  VALUES (
+    NEW.book_id,
+    1,
+    NEW.stars,
+    NEW.stars = 1,
+    NEW.stars = 2,
+    NEW.stars = 3,
+    NEW.stars = 4,
+    NEW.stars = 5
+  )
+  ON CONFLICT (book_id) DO UPDATE SET
+    review_count = review_count + 1,
+    star_sum = star_sum + excluded.star_sum,
+    stars_1 = stars_1 + excluded.stars_1,
+    stars_2 = stars_2 + excluded.stars_2,
+    stars_3 = stars_3 + excluded.stars_3,
+    stars_4 = stars_4 + excluded.stars_4,
+    stars_5 = stars_5 + excluded.stars_5;
+END;
+
+COMMIT;
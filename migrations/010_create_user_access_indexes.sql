@@ -0,0 +1,21 @@
+-- These indexes are needed for the queries that start from a user: the
+-- library of the user, the copies the user owns, the books the user has
+-- read and the reviews the user has left. Every index also contains the ID
+-- of the row, so for example counting the copies with COUNT(o.id) is
+-- answered from the index alone.
+CREATE INDEX IF NOT EXISTS library_user_id_index ON libraries (user_id);
+
+-- Serves the pages of the user and the checks for whether the user owns a
+-- book, which go from the library of the user to the books.
+CREATE INDEX IF NOT EXISTS book_ownership_library_book_index
+ON book_ownerships (library_id, book_id);
+
+-- Serves the lookups that go from a book to the libraries that own it.
+CREATE INDEX IF NOT EXISTS book_ownership_book_library_index
+ON book_ownerships (book_id, library_id);
+
+CREATE INDEX IF NOT EXISTS read_book_user_book_index
+ON read_books (user_id, book_id);
+
+CREATE INDEX IF NOT EXISTS review_user_book_index
+ON reviews (user_id, book_id);
@@ -0,0 +1,194 @@
+# The table books_listing holds the columns that the book listings are
+# sorted by, so that a listing can be read in the order of an index
+# instead of sorting the joined rows of books, authors and classification
+# on every request. The rows are maintained by the triggers below, and the
+# existing books are copied in batches.
+#
+# The classes are sorted by their nested set `lft`, which follows the
+# order of the keys, so that the books of a subtree are a single range of
+# the index. The names are sorted by keys in the Finnish alphabetical
+# order: the keys are lowercase, and å, ä and ö are replaced by the
+# characters that come right after z.
+
+import sqlite3
+
+BATCH_SIZE = 10000
+
+
+def sort_key(column: str) -> str:
+    expr = f"lower(IFNULL({column}, ''))"
+    for letters, key in (("Åå", "{"), ("Ää", "|"), ("Öö", "}")):
+        for letter in letters:
+            expr = f"replace({expr}, '{letter}', '{key}')"
+    return expr
+
+
+LISTING_COLUMNS = """
+    book_id,
+    class_id,
+    class_lft,
+    surname_key,
+    first_name_key,
+    name_key,
+    author,
+    owned_count
+"""
+
+LISTING_ROWS = f"""
+    SELECT
+        b.id,
+        b.class_id,
+        c.lft,
+        {sort_key("a.surname")},
+        {sort_key("a.first_name")},
+        {sort_key("b.name")},
+        IFNULL(a.first_name, '') || ' ' || a.surname,
+        IFNULL(s.owned_count, 0)
+    FROM books AS b
+    JOIN authors AS a ON b.author_id = a.id
+    JOIN classification AS c ON b.class_id = c.id
+    LEFT JOIN book_stats AS s ON b.id = s.book_id
+"""
+
+
+def upgrade(con: sqlite3.Connection):
+    _ = con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS books_listing (
+          book_id INTEGER PRIMARY KEY,
+          class_id INTEGER NOT NULL,
+          class_lft INTEGER NOT NULL,
+          surname_key TEXT NOT NULL,
+          first_name_key TEXT NOT NULL,
+          name_key TEXT NOT NULL,
+          author TEXT NOT NULL,
+          owned_count INTEGER NOT NULL DEFAULT 0,
+          FOREIGN KEY(book_id) REFERENCES books(id)
+        )
+        """
+    )
+
+    # The indexes match the listing order. The ID of the book is the last
+    # column of every index, so it doesn't have to be listed. The partial
+    # index serves the listing of the books that someone owns.
+    _ = con.execute(
+        """
+        CREATE INDEX IF NOT EXISTS books_listing_sort_index
+        ON books_listing (class_lft, surname_key, first_name_key, name_key)
+        """
+    )
+    _ = con.execute(
+        """
+        CREATE INDEX IF NOT EXISTS books_listing_owned_sort_index
+        ON books_listing (class_lft, surname_key, first_name_key, name_key)
+        WHERE owned_count > 0
+        """
+    )
+
+    _ = con.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_insert_listing
+        AFTER INSERT ON books
+        BEGIN
+          INSERT OR REPLACE INTO books_listing ({LISTING_COLUMNS})
+          {LISTING_ROWS}
+          WHERE b.id = NEW.id;
+        END
+        """
+    )
+    _ = con.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS books_update_listing
+        AFTER UPDATE OF name, author_id, class_id ON books
+        BEGIN
+          INSERT OR REPLACE INTO books_listing ({LISTING_COLUMNS})
+          {LISTING_ROWS}
+          WHERE b.id = NEW.id;
+        END
+        """
+    )
+    _ = con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS books_delete_listing
+        AFTER DELETE ON books
+        BEGIN
+          DELETE FROM books_listing WHERE book_id = OLD.id;
+        END
+        """
+    )
+    _ = con.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS authors_update_listing
+        AFTER UPDATE OF first_name, surname ON authors
+        BEGIN
+          UPDATE books_listing
+          SET
+            surname_key = {sort_key("NEW.surname")},
+            first_name_key = {sort_key("NEW.first_name")},
+            author = IFNULL(NEW.first_name, '') || ' ' || NEW.surname
+          WHERE book_id IN (SELECT id FROM books WHERE author_id = NEW.id);
+        END
+        """
+    )
+
+    # The owned counts follow book_stats.
+    _ = con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS book_ownerships_insert_listing
+        AFTER INSERT ON book_ownerships
+        BEGIN
+          UPDATE books_listing
+          SET owned_count = owned_count + 1
+          WHERE book_id = NEW.book_id;
+        END
+        """
+    )
+    _ = con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS book_ownerships_delete_listing
+        AFTER DELETE ON book_ownerships
+        BEGIN
+          UPDATE books_listing
+          SET owned_count = owned_count - 1
+          WHERE book_id = OLD.book_id;
+        END
+        """
+    )
+    _ = con.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS book_ownerships_update_listing
+        AFTER UPDATE OF book_id ON book_ownerships
+        WHEN NEW.book_id != OLD.book_id
+        BEGIN
+          UPDATE books_listing
+          SET owned_count = owned_count - 1
+          WHERE book_id = OLD.book_id;
+          UPDATE books_listing
+          SET owned_count = owned_count + 1
+          WHERE book_id = NEW.book_id;
+        END
+        """
+    )
+
+
+def backfill(con: sqlite3.Connection, position: str | None) -> str | None:
+    last_id = int(position) if position is not None else 0
+    row = con.execute(
+        """
+        SELECT MAX(id)
+        FROM (SELECT id FROM books WHERE id > ? ORDER BY id LIMIT ?)
+        """,
+        [last_id, BATCH_SIZE],
+    ).fetchone()
+    if row[0] is None:
+        return None
+
+    _ = con.execute(
+        f"""
+        INSERT OR REPLACE INTO books_listing ({LISTING_COLUMNS})
+        {LISTING_ROWS}
+        WHERE b.id > ? AND b.id <= ?
+        """,
+        [last_id, row[0]],
+    )
+    return str(row[0])
@@ -0,0 +1,114 @@
+-- The table data_versions holds a version number for each of the tables
+-- that the app writes to. The triggers below increment the version on
+-- every change to the table, so a result computed from the tables stays
+-- valid as long as their versions haven't changed. This lets the app
+-- cache the results across requests and worker processes, as the
+-- versions are read from the database.
+CREATE TABLE IF NOT EXISTS data_versions (
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO data_versions (name)
+VALUES
+  ('authors'),
+  ('books'),
+  ('book_ownerships'),
+  ('read_books'),
+  ('reviews');
+
+CREATE TRIGGER IF NOT EXISTS authors_insert_version
+AFTER INSERT ON authors
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'authors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS authors_update_version
+AFTER UPDATE ON authors
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'authors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS authors_delete_version
+AFTER DELETE ON authors
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'authors';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_insert_version
+AFTER INSERT ON books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_update_version
+AFTER UPDATE ON books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_delete_version
+AFTER DELETE ON books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_insert_version
+AFTER INSERT ON book_ownerships
+BEGIN
+  UPDATE data_versions
+  SET version = version + 1
+  WHERE name = 'book_ownerships';
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_update_version
+AFTER UPDATE ON book_ownerships
+BEGIN
+  UPDATE data_versions
+  SET version = version + 1
+  WHERE name = 'book_ownerships';
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_delete_version
+AFTER DELETE ON book_ownerships
+BEGIN
+  UPDATE data_versions
+  SET version = version + 1
+  WHERE name = 'book_ownerships';
+END;
+
+CREATE TRIGGER IF NOT EXISTS read_books_insert_version
+AFTER INSERT ON read_books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'read_books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS read_books_update_version
+AFTER UPDATE ON read_books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'read_books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS read_books_delete_version
+AFTER DELETE ON read_books
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'read_books';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_insert_version
+AFTER INSERT ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_version
+AFTER UPDATE ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_version
+AFTER DELETE ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
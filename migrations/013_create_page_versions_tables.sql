@@ -0,0 +1,114 @@
+-- The tables book_versions and user_versions hold a version number for
+-- each book and user that the triggers below increment whenever the
+-- data shown on the page of the book or the user changes. The page of a
+-- book shows its reviews, readers and copies, and the page of a user
+-- shows their copies and the books they have read. Together with the
+-- versions in data_versions they let the app tell whether a page has
+-- changed without building it. A book or a user without a row has the
+-- version 0. Deleting a book also increments its version, so that the
+-- pages of the deleted book don't match a new book with the same ID.
+CREATE TABLE IF NOT EXISTS book_versions (
+  book_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_versions (
+  user_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+);
+
+-- The usernames are shown with the reviews.
+INSERT OR IGNORE INTO data_versions (name) VALUES ('users');
+
+CREATE TRIGGER IF NOT EXISTS users_update_version
+AFTER UPDATE OF username ON users
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+  INSERT INTO user_versions (user_id, version)
+  VALUES (NEW.id, 1)
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_update_page_version
+AFTER UPDATE ON books
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS books_delete_page_version
+AFTER DELETE ON books
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (OLD.id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_insert_page_version
+AFTER INSERT ON book_ownerships
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+  INSERT INTO user_versions (user_id, version)
+  SELECT user_id, 1 FROM libraries WHERE id = NEW.library_id
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS book_ownerships_delete_page_version
+AFTER DELETE ON book_ownerships
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (OLD.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+  INSERT INTO user_versions (user_id, version)
+  SELECT user_id, 1 FROM libraries WHERE id = OLD.library_id
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS read_books_insert_page_version
+AFTER INSERT ON read_books
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+  INSERT INTO user_versions (user_id, version)
+  VALUES (NEW.user_id, 1)
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS read_books_delete_page_version
+AFTER DELETE ON read_books
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (OLD.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+  INSERT INTO user_versions (user_id, version)
+  VALUES (OLD.user_id, 1)
+  ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_insert_page_version
+AFTER INSERT ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_page_version
+AFTER UPDATE ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_page_version
+AFTER DELETE ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (OLD.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
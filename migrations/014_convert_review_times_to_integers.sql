@@ -0,0 +1,190 @@
+-- Stores the times of the reviews as Unix timestamps instead of the text
+-- written by datetime('now'), so that reading a review doesn't have to
+-- parse the times. The columns of a table can't be altered in SQLite, so
+-- the table is rebuilt the same way as in
+-- 003_alter_review_timestamp_not_null.sql.
+CREATE TABLE IF NOT EXISTS new_reviews (
+  id INTEGER PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  book_id INTEGER NOT NULL,
+  stars INTEGER NOT NULL,
+  message TEXT,
+  time INTEGER NOT NULL,
+  last_edited INTEGER NOT NULL,
+  FOREIGN KEY(user_id) REFERENCES users(id),
+  FOREIGN KEY(book_id) REFERENCES books(id)
+);
+
+INSERT INTO new_reviews (
+  id,
+  user_id,
+  book_id,
+  stars,
+  message,
+  time,
+  last_edited
+)
+SELECT
+  id,
+  user_id,
+  book_id,
+  stars,
+  message,
+  CAST(strftime('%s', time) AS INTEGER),
+  CAST(strftime('%s', last_edited) AS INTEGER)
+FROM reviews;
+
+-- Dropping the table also drops its indexes and triggers, so they are
+-- created again below. review_book_id_index from
+-- 005_create_review_book_id_index.sql is not, as
+-- review_book_last_edited_index starts with the same column.
+DROP TABLE reviews;
+
+ALTER TABLE new_reviews RENAME TO reviews;
+
+-- From 009_create_book_ratings_table.sql.
+CREATE INDEX IF NOT EXISTS review_book_last_edited_index
+ON reviews (book_id, last_edited DESC, id DESC);
+
+-- From 010_create_user_access_indexes.sql.
+CREATE INDEX IF NOT EXISTS review_user_book_index
+ON reviews (user_id, book_id);
+
+-- From 009_create_book_ratings_table.sql.
+CREATE TRIGGER IF NOT EXISTS reviews_insert_ratings
+AFTER INSERT ON reviews
+BEGIN
+  INSERT INTO book_ratings (
+    book_id,
+    review_count,
+    star_sum,
+    stars_1,
+    stars_2,
+    stars_3,
+    stars_4,
+    stars_5
+  )
+  VALUES (
+    NEW.book_id,
+    1,
+    NEW.stars,
+    NEW.stars = 1,
+    NEW.stars = 2,
+    NEW.stars = 3,
+    NEW.stars = 4,
+    NEW.stars = 5
+  )
+  ON CONFLICT (book_id) DO UPDATE SET
+    review_count = review_count + 1,
+    star_sum = star_sum + excluded.star_sum,
+    stars_1 = stars_1 + excluded.stars_1,
+    stars_2 = stars_2 + excluded.stars_2,
+    stars_3 = stars_3 + excluded.stars_3,
+    stars_4 = stars_4 + excluded.stars_4,
+    stars_5 = stars_5 + excluded.stars_5;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_ratings
+AFTER DELETE ON reviews
+BEGIN
+  UPDATE book_ratings
+  SET
+    review_count = review_count - 1,
+    star_sum = star_sum - OLD.stars,
+    stars_1 = stars_1 - (OLD.stars = 1),
+    stars_2 = stars_2 - (OLD.stars = 2),
+    stars_3 = stars_3 - (OLD.stars = 3),
+    stars_4 = stars_4 - (OLD.stars = 4),
+    stars_5 = stars_5 - (OLD.stars = 5)
+  WHERE book_id = OLD.book_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_ratings
+AFTER UPDATE OF stars, book_id ON reviews
+BEGIN
+  UPDATE book_ratings
+  SET
+    review_count = review_count - 1,
+    star_sum = star_sum - OLD.stars,
+    stars_1 = stars_1 - (OLD.stars = 1),
+    stars_2 = stars_2 - (OLD.stars = 2),
+    stars_3 = stars_3 - (OLD.stars = 3),
+    stars_4 = stars_4 - (OLD.stars = 4),
+    stars_5 = stars_5 - (OLD.stars = 5)
+  WHERE book_id = OLD.book_id;
+  INSERT INTO book_ratings (
+    book_id,
+    review_count,
+    star_sum,
+    stars_1,
+    stars_2,
+    stars_3,
+    stars_4,
+    stars_5
+  )
+  VALUES (
+    NEW.book_id,
+    1,
+    NEW.stars,
+    NEW.stars = 1,
+    NEW.stars = 2,
+    NEW.stars = 3,
+    NEW.stars = 4,
+    NEW.stars = 5
+  )
+  ON CONFLICT (book_id) DO UPDATE SET
+    review_count = review_count + 1,
+    star_sum = star_sum + excluded.star_sum,
+    stars_1 = stars_1 + excluded.stars_1,
+    stars_2 = stars_2 + excluded.stars_2,
+    stars_3 = stars_3 + excluded.stars_3,
+    stars_4 = stars_4 + excluded.stars_4,
+    stars_5 = stars_5 + excluded.stars_5;
+END;
+
+-- From 012_create_data_versions_table.sql.
+CREATE TRIGGER IF NOT EXISTS reviews_insert_version
+AFTER INSERT ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_version
+AFTER UPDATE ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_version
+AFTER DELETE ON reviews
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
+END;
+
+-- From 013_create_page_versions_tables.sql.
+CREATE TRIGGER IF NOT EXISTS reviews_insert_page_version
+AFTER INSERT ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_update_page_version
+AFTER UPDATE ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (NEW.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS reviews_delete_page_version
+AFTER DELETE ON reviews
+BEGIN
+  INSERT INTO book_versions (book_id, version)
+  VALUES (OLD.book_id, 1)
+  ON CONFLICT (book_id) DO UPDATE SET version = version + 1;
+END;
+
+-- The cached pages of the books show the times of the reviews.
+UPDATE data_versions SET version = version + 1 WHERE name = 'reviews';
@@ -0,0 +1,411 @@
+import argparse
+import hashlib
+import importlib.util
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
+from types import ModuleType
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+MIGRATIONS_DIR = os.path.join(ROOT, "migrations")
+
+# The migration files are named like "001_create_read_table.sql". The
+# number is the version of the migration and the migrations are applied
+# in the order of the versions.
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.(sql|py)$")
+
+# The applied migrations are recorded in schema_version. A Python
+# migration that is run in batches stores the position of the last
+# finished batch in schema_migration_progress so that it can continue
+# from there if it is interrupted.
+BOOKKEEPING_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+  version INTEGER PRIMARY KEY,
+  name TEXT NOT NULL,
+  checksum TEXT NOT NULL,
+  applied_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS schema_migration_progress (
+  version INTEGER PRIMARY KEY,
+  position TEXT,
+  updated_at TEXT NOT NULL
+);
+"""
+
+# The migrations 001-009 were run with the sqlite3 CLI before the runner
+# and each of them commits its own transaction. The runner applies a SQL
+# migration in a transaction of its own, so it leaves these lines out when
+# it runs the file. The files themselves are not changed, as that would
+# change their checksums.
+TRANSACTION_LINE = re.compile(
+    r"^\s*(BEGIN(\s+TRANSACTION)?|COMMIT(\s+TRANSACTION)?)\s*;\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+# The old migrate script ran every migration up to this version on each
+# run without recording them. A database that it has migrated has the
+# tables of these migrations but no schema_version.
+LEGACY_VERSION = 5
+
+# The pause between the batches of a Python migration in seconds. The
+# write lock is released between the batches, and the pause gives the
+# app a chance to take it.
+BATCH_PAUSE = 0.01
+
+
+class MigrationError(Exception):
+    pass
+
+
+@dataclass
+class Migration:
+    """
+    Migration is a single file in the migrations directory. `checksum` is
+    the SHA-256 of the contents of the file.
+
+    A SQL migration is run as a whole in a single transaction, so the
+    file must not begin or commit transactions of its own. The
+    `BEGIN TRANSACTION;` and `COMMIT;` lines of the migrations written for
+    the sqlite3 CLI are left out when the file is run.
+
+    A Python migration may define the following functions:
+
+    - `upgrade(con)` is run once in a single transaction. It should do the
+      schema changes of the migration.
+    - `backfill(con, position)` is run repeatedly, each call in its own
+      transaction, until it returns None. `position` is None on the first
+      call and after that the value the previous call returned. A call
+      should handle one batch of rows, for example the rows after the ID
+      in `position`, and return the position to continue from.
+
+    The position is stored with each batch, so an interrupted backfill
+    continues from the last finished batch when the migrations are run
+    again.
+    """
+
+    version: int
+    name: str
+    path: str
+    checksum: str
+
+    @property
+    def filename(self) -> str:
+        return os.path.basename(self.path)
+
+
+def find_migrations(directory: str = MIGRATIONS_DIR) -> list[Migration]:
+    migrations: dict[int, Migration] = {}
+    for filename in sorted(os.listdir(directory)):
+        m = MIGRATION_FILE.match(filename)
+        if m is None:
+            continue
+        path = os.path.join(directory, filename)
+        with open(path, "rb") as f:
+            checksum = hashlib.sha256(f.read()).hexdigest()
+        migration = Migration(
+            version=int(m[1]), name=m[2], path=path, checksum=checksum
+        )
+        if migration.version in migrations:
+            raise MigrationError(
+                f"duplicate migration version {migration.version}: "
+                + f"{migrations[migration.version].filename} and {filename}"
+            )
+        migrations[migration.version] = migration
+    return sorted(migrations.values(), key=lambda m: m.version)
+
+
+def connect(database: str) -> sqlite3.Connection:
+    # The transactions are managed explicitly.
+    con = sqlite3.connect(database, isolation_level=None)
+    _ = con.execute("PRAGMA busy_timeout = 5000")
+    _ = con.executescript(BOOKKEEPING_SQL)
+    return con
+
+
+def initialize(database: str):
+    """
+    Creates a new database with the schema and the classification.
+    """
+    print(f"Creating the database: {database}")
+    con = sqlite3.connect(database)
+    try:
+        with open(os.path.join(ROOT, "schema.sql")) as f:
+            _ = con.executescript(f.read())
+    finally:
+        con.close()
+    _ = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(ROOT, "scripts", "gen_sql_init.py"),
+            "--database",
+            database,
+        ],
+        check=True,
+    )
+
+
+def get_applied(con: sqlite3.Connection) -> dict[int, str]:
+    """
+    Returns the checksums of the applied migrations by their versions.
+    """
+    return dict(con.execute("SELECT version, checksum FROM schema_version"))
+
+
+def get_pending(
+    con: sqlite3.Connection, migrations: Sequence[Migration]
+) -> list[Migration]:
+    """
+    Returns the migrations that have not been applied. Raises an error if
+    an applied migration has been changed after it was applied.
+    """
+    applied = get_applied(con)
+    pending: list[Migration] = []
+    for migration in migrations:
+        checksum = applied.get(migration.version)
+        if checksum is None:
+            pending.append(migration)
+        elif checksum != migration.checksum:
+            raise MigrationError(
+                f"{migration.filename} has been changed after it was applied"
+            )
+    return pending
+
+
+def _record(con: sqlite3.Connection, migration: Migration):
+    _ = con.execute(
+        """
+        INSERT INTO schema_version (version, name, checksum, applied_at)
+        VALUES (?, ?, ?, datetime('now'))
+        """,
+        [migration.version, migration.name, migration.checksum],
+    )
+
+
+def _rollback(con: sqlite3.Connection):
+    if con.in_transaction:
+        _ = con.execute("ROLLBACK")
+
+
+def stamp_legacy(con: sqlite3.Connection, migrations: Sequence[Migration]):
+    """
+    Records the migrations up to LEGACY_VERSION as applied if the database
+    was migrated by the old migrate script, so that they are not run again.
+    """
+    if con.execute("SELECT 1 FROM schema_version LIMIT 1").fetchone():
+        return
+    reviews = con.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reviews'"
+    ).fetchone()
+    if reviews is None:
+        return
+    print(
+        "Recording the migrations up to "
+        + f"{LEGACY_VERSION:03} of the old migrate script as applied"
+    )
+    _ = con.execute("BEGIN IMMEDIATE")
+    try:
+        for migration in migrations:
+            if migration.version <= LEGACY_VERSION:
+                _record(con, migration)
+        _ = con.execute("COMMIT")
+    except BaseException:
+        _rollback(con)
+        raise
+
+
+def apply_sql(con: sqlite3.Connection, migration: Migration):
+    with open(migration.path) as f:
+        sql = TRANSACTION_LINE.sub("", f.read())
+    # executescript() commits any open transaction before it runs the
+    # script, so the transaction is part of the script.
+    record = (
+        "INSERT INTO schema_version (version, name, checksum, applied_at) "
+        + f"VALUES ({migration.version}, '{migration.name}', "
+        + f"'{migration.checksum}', datetime('now'));"
+    )
+    try:
+        _ = con.executescript(f"BEGIN IMMEDIATE;\n{sql}\n;\n{record}\nCOMMIT;")
+    except sqlite3.Error:
+        _rollback(con)
+        raise
+
+
+def load_module(migration: Migration) -> ModuleType:
+    """
+    Loads a Python migration as a module without running it.
+    """
+    spec = importlib.util.spec_from_file_location(
+        f"migration_{migration.version:03}", migration.path
+    )
+    if spec is None or spec.loader is None:
+        raise MigrationError(f"failed to load {migration.filename}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def apply_python(
+    con: sqlite3.Connection, migration: Migration, pause: float = BATCH_PAUSE
+):
+    module = load_module(migration)
+    upgrade = getattr(module, "upgrade", None)
+    backfill = getattr(module, "backfill", None)
+
+    row = con.execute(
+        "SELECT position FROM schema_migration_progress WHERE version = ?",
+        [migration.version],
+    ).fetchone()
+    position: str | None = None
+    try:
+        if row is None:
+            _ = con.execute("BEGIN IMMEDIATE")
+            if upgrade is not None:
+                upgrade(con)
+            if backfill is None:
+                _record(con, migration)
+            else:
+                _ = con.execute(
+                    """
+                    INSERT INTO schema_migration_progress (
+                      version,
+                      position,
+                      updated_at
+                    )
+                    VALUES (?, NULL, datetime('now'))
+                    """,
+                    [migration.version],
+                )
+            _ = con.execute("COMMIT")
+        else:
+            position = row[0]
+            print(f"Continuing {migration.filename} from {position}")
+
+        if backfill is None:
+            return
+
+        start = time.perf_counter()
+        batches = 0
+        while True:
+            _ = con.execute("BEGIN IMMEDIATE")
+            position = backfill(con, position)
+            if position is None:
+                _ = con.execute(
+                    "DELETE FROM schema_migration_progress WHERE version = ?",
+                    [migration.version],
+                )
+                _record(con, migration)
+                _ = con.execute("COMMIT")
+                break
+            _ = con.execute(
+                """
+                UPDATE schema_migration_progress
+                SET position = ?, updated_at = datetime('now')
+                WHERE version = ?
+                """,
+                [str(position), migration.version],
+            )
+            _ = con.execute("COMMIT")
+            batches += 1
+            if batches % 100 == 0:
+                print(
+                    f"{migration.filename}: {batches} batches in "
+                    + f"{time.perf_counter() - start:.1f} s, at {position}"
+                )
+            time.sleep(pause)
+    except BaseException:
+        _rollback(con)
+        raise
+
+
+def migrate(database: str, pause: float = BATCH_PAUSE) -> int:
+    """
+    Applies the pending migrations to the given database in order. The
+    database is created first if it doesn't exist. Returns the number of
+    the applied migrations.
+    """
+    if not os.path.exists(database):
+        initialize(database)
+
+    migrations = find_migrations()
+    con = connect(database)
+    try:
+        stamp_legacy(con, migrations)
+        pending = get_pending(con, migrations)
+        for migration in pending:
+            print(f"Running migration: {migration.filename}")
+            start = time.perf_counter()
+            try:
+                if migration.path.endswith(".py"):
+                    apply_python(con, migration, pause)
+                else:
+                    apply_sql(con, migration)
+            except sqlite3.Error as e:
+                raise MigrationError(
+                    f"error running migration {migration.filename}: {e}"
+                ) from e
+            print(f"Done in {time.perf_counter() - start:.1f} s")
+    finally:
+        con.close()
+    return len(pending)
+
+
+def print_status(database: str):
+    con = connect(database)
+    try:
+        applied = get_applied(con)
+        progress = dict(
+            con.execute(
+                "SELECT version, position FROM schema_migration_progress"
+            )
+        )
+    finally:
+        con.close()
+    for migration in find_migrations():
+        if migration.version in progress:
+            status = f"in progress at {progress[migration.version]}"
+        elif migration.version not in applied:
+            status = "pending"
+        elif applied[migration.version] != migration.checksum:
+            status = "changed after it was applied"
+        else:
+            status = "applied"
+        print(f"{migration.filename}: {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Applies the pending migrations to the database."
+    )
+    _ = parser.add_argument(
+        "--database",
+        default=os.environ.get("DATABASE", "database.db"),
+        help="the database to migrate",
+    )
+    _ = parser.add_argument(
+        "--status",
+        action="store_true",
+        help="print the status of the migrations without applying them",
+    )
+    _ = parser.add_argument(
+        "--pause",
+        type=float,
+        default=BATCH_PAUSE,
+        help="the pause between the batches of the data migrations in s",
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.status:
+            print_status(args.database)
+            return
+        if migrate(args.database, args.pause) == 0:
+            print("The database is up to date")
+    except MigrationError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+# A helper script for measuring the performance of the app. It builds a
+# database filled by seed.py at the given scale, runs requests to the
+# routes of the app through the Flask test client and prints the
+# latencies and the throughput of each route as JSON. The database is
+# reused between the runs unless --rebuild is given.
+#
+#     ./scripts/benchmark.py --scale small --output bench.json
+#
+# The write endpoints modify the benchmark database, so it should not be
+# the database of the app.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import sqlite3
+import subprocess
+import sys
+import time
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import quote
+
+from flask.testing import FlaskClient
+
+ROOT = os.path.realpath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+)
+
+sys.path.insert(0, ROOT)
+
+import migrator
+import seed
+
+
+@dataclass
+class Route:
+    """
+    Route is a single benchmarked route. `request` runs one request and
+    returns its status code. The argument of it is the number of the
+    request so that the requests can vary the URL.
+    """
+
+    name: str
+    request: Callable[[int], int]
+
+
+@dataclass
+class Fixture:
+    """
+    Fixture contains the data of the benchmark database that the requests
+    refer to.
+    """
+
+    book_ids: Sequence[int]
+    usernames: Sequence[str]
+    user_id: int
+    surnames: Sequence[str]
+    book_names: Sequence[str]
+    class_keys: Sequence[str]
+    page_count: int
+
+
+def build_database(path: str, scale: str, seed: int):
+    """
+    Creates a new database at the given path with the migrations and
+    fills it using seed.py. The database is built in a temporary file that
+    is moved to the path only when the build succeeds, so a failed build
+    doesn't leave a partial database to be reused by the next run.
+    """
+    building = f"{path}.tmp"
+    remove_database(building)
+
+    print(f"Building the {scale} database at {path}", file=sys.stderr)
+    try:
+        _ = migrator.migrate(building)
+
+        _ = subprocess.run(
+            [
+                sys.executable,
+                os.path.join(ROOT, "seed.py"),
+                "--database",
+                building,
+                "--scale",
+                scale,
+                "--seed",
+                str(seed),
+                "--bulk",
+            ],
+            check=True,
+        )
+    except BaseException:
+        remove_database(building)
+        raise
+    remove_database(path)
+    os.replace(building, path)
+
+
+def remove_database(path: str):
+    """
+    Removes the database file at the given path with its WAL files.
+    """
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path + suffix)
+
+
+def load_fixture(path: str, rng: random.Random, count: int) -> Fixture:
+    con = sqlite3.connect(path)
+
+    def column(sql: str) -> list[Any]:  # pyright: ignore[reportExplicitAny]
+        return [r[0] for r in con.execute(sql)]
+
+    max_book_id = column("SELECT MAX(id) FROM books")[0] or 1
+    max_author_id = column("SELECT MAX(id) FROM authors")[0] or 1
+    max_user_id = column("SELECT MAX(id) FROM users")[0] or 1
+    book_ids = [rng.randint(1, max_book_id) for _ in range(count)]
+    author_ids = [rng.randint(1, max_author_id) for _ in range(count)]
+    user_ids = [rng.randint(1, max_user_id) for _ in range(count)]
+
+    def lookup(sql: str, ids: Sequence[int]) -> list[str]:
+        values = dict(
+            con.execute(
+                sql.format(", ".join("?" * len(set(ids)))), list(set(ids))
+            ).fetchall()
+        )
+        return [values[i] for i in ids if i in values]
+
+    fixture = Fixture(
+        book_ids=book_ids,
+        usernames=lookup(
+            "SELECT id, username FROM users WHERE id IN ({})", user_ids
+        ),
+        user_id=column("SELECT MIN(user_id) FROM libraries")[0] or 1,
+        surnames=lookup(
+            "SELECT id, surname FROM authors WHERE id IN ({})", author_ids
+        ),
+        book_names=lookup(
+            "SELECT id, name FROM books WHERE id IN ({})", book_ids
+        ),
+        class_keys=column(
+            "SELECT key FROM classification WHERE rgt - lft > 1"
+        ),
+        page_count=max(
+            1,
+            column("SELECT COUNT(*) FROM book_stats WHERE owned_count > 0")[0]
+            // 10,
+        ),
+    )
+    con.close()
+    return fixture
+
+
+def make_routes(fixture: Fixture, rng: random.Random) -> list[Route]:
+    import app
+
+    client = app.app.test_client()
+    user = app.app.test_client()
+    token = secrets.token_hex(16)
+    with user.session_transaction() as session:
+        session["user_id"] = fixture.user_id
+        session["username"] = "benchmark"
+        session["csrf_token"] = token
+    headers = {"Referer": "/"}
+
+    def get(c: FlaskClient, url: Callable[[int], str]) -> Callable[[int], int]:
+        return lambda i: c.get(url(i), headers=headers).status_code
+
+    def pick(values: Sequence[str] | Sequence[int], i: int) -> str:
+        return quote(str(values[i % len(values)])) if values else ""
+
+    pages = [rng.randint(2, max(2, fixture.page_count)) for _ in range(100)]
+
+    def review_cycle(i: int) -> int:
+        book_id = pick(fixture.book_ids, i)
+        review = {"stars": "3", "message": "", "csrf_token": token}
+        _ = user.get(
+            f"/mark-as-read/?id={book_id}&token={token}", headers=headers
+        )
+        status = user.post(
+            f"/add-review/?id={book_id}", data=review, headers=headers
+        ).status_code
+        _ = user.post(
+            f"/update-review/?id={book_id}", data=review, headers=headers
+        )
+        _ = user.get(
+            f"/remove-review/?id={book_id}&token={token}", headers=headers
+        )
+        return status
+
+    def ownership_cycle(i: int) -> int:
+        book_id = pick(fixture.book_ids, i)
+        status = user.get(
+            f"/add-one-book/?id={book_id}&token={token}", headers=headers
+        ).status_code
+        _ = user.get(
+            f"/delete-one-book/?id={book_id}&token={token}", headers=headers
+        )
+        return status
+
+    return [
+        Route("index", get(client, lambda i: "/")),
+        Route("index (logged in)", get(user, lambda i: "/")),
+        Route("library", get(client, lambda i: "/kirjasto/")),
+        Route(
+            "library page",
+            get(client, lambda i: f"/kirjasto/{pick(pages, i)}/"),
+        ),
+        Route(
+            "library page (logged in)",
+            get(user, lambda i: f"/kirjasto/{pick(pages, i)}/"),
+        ),
+        Route(
+            "search by name",
+            get(
+                client,
+                lambda i: (
+                    f"/kirjasto/haku/?name={pick(fixture.book_names, i)}"
+                ),
+            ),
+        ),
+        Route(
+            "search by author",
+            get(
+                client,
+                lambda i: (
+                    f"/kirjasto/haku/?author={pick(fixture.surnames, i)}"
+                ),
+            ),
+        ),
+        Route(
+            "class page",
+            get(
+                client,
+                lambda i: f"/kirjasto/luokitus/{pick(fixture.class_keys, i)}/",
+            ),
+        ),
+        Route(
+            "book page",
+            get(client, lambda i: f"/kirja/{pick(fixture.book_ids, i)}"),
+        ),
+        Route(
+            "book page (logged in)",
+            get(user, lambda i: f"/kirja/{pick(fixture.book_ids, i)}"),
+        ),
+        Route(
+            "user page",
+            get(client, lambda i: f"/kayttaja/{pick(fixture.usernames, i)}/"),
+        ),
+        Route(
+            "user read page",
+            get(
+                client,
+                lambda i: f"/kayttaja/{pick(fixture.usernames, i)}/luetut/",
+            ),
+        ),
+        Route("add and delete a copy", ownership_cycle),
+        Route("add, edit and remove a review", review_cycle),
+    ]
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """
+    Returns the p-th percentile of the values using the nearest-rank
+    method.
+    """
+    ordered = sorted(values)
+    rank = max(1, round(p / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def run(route: Route, count: int, warmup: int) -> dict[str, float | int]:
+    for i in range(warmup):
+        _ = route.request(i)
+
+    latencies: list[float] = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(count):
+        t = time.perf_counter()
+        status = route.request(i)
+        latencies.append((time.perf_counter() - t) * 1000)
+        if status >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "throughput_rps": round(count / elapsed, 1),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measures the latencies of the routes of the app."
+    )
+    _ = parser.add_argument(
+        "--scale",
+        choices=seed.SCALES.keys(),
+        default="small",
+        help="the size of the data set",
+    )
+    _ = parser.add_argument(
+        "--database",
+        help="the benchmark database, bench-<scale>.db by default",
+    )
+    _ = parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="build the database even if it exists",
+    )
+    _ = parser.add_argument(
+        "--requests",
+        type=int,
+        default=200,
+        help="the number of measured requests per route",
+    )
+    _ = parser.add_argument(
+        "--warmup",
+        type=int,
+        default=10,
+        help="the number of requests per route before measuring",
+    )
+    _ = parser.add_argument(
+        "--routes", help="run only the routes whose name contains this"
+    )
+    _ = parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="the seed for the generated data and for picking the URLs",
+    )
+    _ = parser.add_argument(
+        "--cache",
+        choices=("memory", "sqlite", "none"),
+        default="memory",
+        help="the backend of the result cache of the app",
+    )
+    _ = parser.add_argument("--output", help="write the results to a file")
+    args = parser.parse_args()
+
+    database = os.path.realpath(
+        args.database or os.path.join(ROOT, f"bench-{args.scale}.db")
+    )
+    if args.rebuild or not os.path.exists(database):
+        build_database(database, args.scale, args.seed)
+
+    rng = random.Random(args.seed)
+    fixture = load_fixture(database, rng, max(args.requests, 100))
+
+    # The app reads the database from the environment when it is
+    # imported.
+    os.environ["DATABASE"] = database
+    os.environ["CACHE_BACKEND"] = args.cache
+    # The entries of an earlier run might be for different data that has
+    # the same versions, so every run starts with an empty cache.
+    cache_database = database.removesuffix(".db") + "-cache.db"
+    for suffix in ("", "-wal", "-shm"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(cache_database + suffix)
+    os.environ["CACHE_DATABASE"] = cache_database
+    os.chdir(ROOT)
+
+    results: dict[str, dict[str, float | int]] = {}
+    # The app prints a line for every request, which would only slow
+    # the measurements down.
+    with contextlib.redirect_stdout(io.StringIO()):
+        routes = make_routes(fixture, rng)
+        for route in routes:
+            if args.routes and args.routes not in route.name:
+                continue
+            print(f"{route.name}...", file=sys.stderr)
+            results[route.name] = run(route, args.requests, args.warmup)
+
+    output = json.dumps(
+        {
+            "commit": git_commit(),
+            "scale": args.scale,
+            "database": database,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "requests": args.requests,
+            "cache": args.cache,
+            "routes": results,
+        },
+        indent=2,
+        ensure_ascii=False,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            _ = f.write(output + "\n")
+    print(output)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+
+# A helper script for catching query plan regressions. It runs a set of
+# requests through the app against a copy of the database, collects
+# every SQL statement that the modules issue and runs EXPLAIN QUERY PLAN
+# for each of them. Full scans of the large tables and temporary B-tree
+# sorts are flagged, and the results are compared to the baseline in
+# scripts/query_plans.json.
+#
+# Run the script in the root of the repository against a seeded
+# database:
+#
+#     ./scripts/check_query_plans.py --database database.db
+#
+# After an intentional change, for example a new index, update the
+# baseline with --update.
+
+import argparse
+import html
+import json
+import os
+import re
+import secrets
+import sqlite3
+import sys
+import tempfile
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from types import FrameType
+from urllib.parse import quote, unquote
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+BASELINE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "query_plans.json"
+)
+
+# The modules whose statements are checked. The statement is attributed
+# to the innermost function of these modules in the call stack.
+MODULES = ("add_book", "author", "classification", "library", "users")
+
+# The tables that grow with the data. A full scan of any of these is
+# flagged. The small lookup tables may be scanned freely.
+LARGE_TABLES = (
+    "authors",
+    "book_ownerships",
+    "book_ratings",
+    "book_stats",
+    "books",
+    "class_index_words",
+    "classification",
+    "libraries",
+    "read_books",
+    "reviews",
+    "users",
+)
+
+STATEMENT_KEYWORDS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+@dataclass
+class Statement:
+    """
+    Statement is a single distinct SQL statement issued by the app.
+    `sql` is the statement with the values replaced by placeholders and
+    `example` is the statement with the values as it was first run.
+    """
+
+    caller: str
+    sql: str
+    example: str
+    plan: list[str] = field(default_factory=list)
+    flags: list[str] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return f"{self.caller}: {self.sql}"
+
+
+def normalize(sql: str) -> str:
+    """
+    Replaces the literal values in a statement with placeholders. The
+    traced statements have the parameters expanded into them.
+    """
+    sql = " ".join(sql.split())
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])", "?", sql)
+    return re.sub(r"\?(?:\s*,\s*\?)+", "?, ...", sql)
+
+
+def find_caller(frame: FrameType | None) -> str | None:
+    while frame is not None:
+        module = frame.f_globals.get("__name__")
+        if module in MODULES:
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def table_aliases(sql: str) -> dict[str, str]:
+    aliases = {t: t for t in LARGE_TABLES}
+    for table, alias in re.findall(
+        r"\b(\w+)\s+AS\s+(\w+)\b", sql, flags=re.IGNORECASE
+    ):
+        aliases[alias] = table
+    return aliases
+
+
+def flag_plan(sql: str, plan: Sequence[str]) -> list[str]:
+    """
+    Returns the problems in the query plan of the given statement.
+    """
+    aliases = table_aliases(sql)
+    flags: list[str] = []
+    for detail in plan:
+        detail = detail.strip()
+        m = re.match(r"SCAN (\w+)(.*)", detail)
+        if m and "VIRTUAL TABLE" not in m[2]:
+            table = aliases.get(m[1], m[1])
+            if table in LARGE_TABLES:
+                flags.append(f"SCAN {table}{m[2]}")
+        if detail.startswith("USE TEMP B-TREE"):
+            flags.append(detail)
+    return flags
+
+
+def explain(con: sqlite3.Connection, sql: str) -> list[str]:
+    rows = con.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    # The details are indented by their depth in the plan so that the
+    # structure of the subqueries stays readable in the baseline.
+    depth: dict[int, int] = {0: -1}
+    plan: list[str] = []
+    for id, parent, _, detail in rows:
+        depth[id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[id] + detail)
+    return plan
+
+
+def run_requests(database: str):
+    """
+    Runs the requests that exercise the statements of the app against
+    the given database. The database is modified by the requests.
+    """
+    con = sqlite3.connect(database)
+    con.row_factory = sqlite3.Row
+
+    def one(sql: str, default: object = None) -> object:
+        row = con.execute(sql).fetchone()
+        return row[0] if row is not None else default
+
+    # The pages of the users with the most copies and the most read books
+    # are shown one book at a time, so that they have next pages and the
+    # cursor queries of both listings are run.
+    user_id = one(
+        """
+        SELECT l.user_id
+        FROM libraries AS l
+        LEFT JOIN book_ownerships AS o ON o.library_id = l.id
+        GROUP BY l.id
+        ORDER BY COUNT(o.id) DESC, l.id
+        LIMIT 1
+        """
+    )
+    username = str(one(f"SELECT username FROM users WHERE id = {user_id}"))
+    reader = str(
+        one(
+            """
+            SELECT u.username
+            FROM read_books AS r
+            JOIN users AS u ON u.id = r.user_id
+            GROUP BY r.user_id
+            ORDER BY COUNT(r.id) DESC, r.user_id
+            LIMIT 1
+            """,
+            username,
+        )
+    )
+    reviewed_id = one("SELECT book_id FROM reviews LIMIT 1", 1)
+    book_id = one(
+        f"""
+        SELECT id FROM books
+        WHERE id NOT IN (SELECT book_id FROM read_books WHERE user_id = {user_id})
+        ORDER BY id LIMIT 1
+        """,
+        1,
+    )
+    class_key = one(
+        "SELECT key FROM classification WHERE rgt - lft > 1 ORDER BY lft LIMIT 1"
+    )
+    surname = quote(str(one("SELECT surname FROM authors LIMIT 1", "")))
+    book_name = str(one("SELECT name FROM books LIMIT 1", ""))
+    con.close()
+
+    import app
+
+    client = app.app.test_client()
+
+    def get(url: str, follow_next: bool = False):
+        response = client.get(url, headers={"Referer": "/"})
+        if response.status_code >= 500:
+            print(f"warning: GET {url} returned {response.status_code}")
+        if follow_next:
+            m = re.search(
+                r'<a href="([^"]+)">&gt;&gt;</a>', response.get_data(True)
+            )
+            if m:
+                get(html.unescape(m[1]))
+
+    def post(url: str, data: dict[str, str]):
+        response = client.post(url, data=data, headers={"Referer": "/"})
+        if response.status_code >= 500:
+            print(f"warning: POST {url} returned {response.status_code}")
+
+    pages = [
+        "/",
+        "/kirjasto/",
+        f"/kirjasto/haku/?name={quote(book_name.split(' ')[0])}",
+        f"/kirjasto/haku/?author={surname}",
+        f"/kirjasto/haku/?author={surname}&order=rank",
+        "/kirjasto/haku/?classification=kirjallisuus",
+        "/kirjasto/luokitus/",
+        f"/kirjasto/luokitus/{class_key}/",
+        f"/kirja/{reviewed_id}",
+        f"/kayttaja/{username}/?per_page=1",
+        f"/kayttaja/{reader}/luetut/?per_page=1",
+    ]
+    for url in pages:
+        get(url, follow_next=True)
+    post("/kirjaudu/", {"username": username, "password": "x"})
+
+    token = secrets.token_hex(16)
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+        session["username"] = username
+        session["csrf_token"] = token
+    for url in pages:
+        get(url, follow_next=True)
+
+    get(f"/add-one-book/?id={book_id}&token={token}")
+    get(f"/kirja/{book_id}/muokkaa/")
+    get(f"/kirja/{book_id}/muokkaa-luokitusta/")
+    get(f"/mark-as-read/?id={book_id}&token={token}")
+    review = {"stars": "4", "message": "", "csrf_token": token}
+    post(f"/add-review/?id={book_id}", review)
+    get(f"/kirja/{book_id}/muokkaa-arvostelua/")
+    post(f"/update-review/?id={book_id}", review)
+    get(f"/remove-review/?id={book_id}&token={token}")
+    get(f"/delete-one-book/?id={book_id}&token={token}")
+    post(
+        "/lisaa-kirja/",
+        {
+            "from-page": "0",
+            "first-name-search": "",
+            "surname-search": unquote(surname),
+            "csrf_token": token,
+        },
+    )
+
+
+def collect(source: str) -> list[Statement]:
+    """
+    Runs the requests against a copy of the given database and returns
+    the distinct statements that were run with their query plans.
+    """
+    statements: dict[str, Statement] = {}
+
+    def trace(sql: str):
+        if not sql.lstrip().upper().startswith(STATEMENT_KEYWORDS):
+            return
+        # The full-text indexes run statements of their own on the
+        # shadow tables, which are referred to with the schema name.
+        if "'main'." in sql:
+            return
+        caller = find_caller(sys._getframe(1))
+        if caller is None:
+            return
+        s = Statement(caller=caller, sql=normalize(sql), example=sql)
+        _ = statements.setdefault(s.key, s)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "database.db")
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(database)
+        src.backup(dst)
+        src.close()
+        dst.close()
+
+        # The app is pointed to the copy so that the requests don't
+        # modify the actual database.
+        os.environ["DATABASE"] = database
+        # The cached results would hide the statements of the requests
+        # that repeat the same reads.
+        os.environ["CACHE_BACKEND"] = "none"
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        import db
+
+        connect = db.connect
+
+        def traced_connect() -> sqlite3.Connection:
+            con = connect()
+            con.set_trace_callback(trace)
+            return con
+
+        db.connect = traced_connect
+        run_requests(database)
+
+        con = sqlite3.connect(database)
+        for s in statements.values():
+            try:
+                s.plan = explain(con, s.example)
+            except sqlite3.Error as e:
+                s.plan = [f"error: {e}"]
+            s.flags = flag_plan(s.example, s.plan)
+        con.close()
+
+    return sorted(statements.values(), key=lambda s: s.key)
+
+
+def compare(
+    statements: Sequence[Statement], baseline: dict[str, dict]
+) -> tuple[int, int]:
+    """
+    Prints the differences between the statements and the baseline.
+    Returns the number of regressions, i.e. new flags, and the number of
+    the statements of the baseline that were not run. A statement that
+    isn't run can't be checked, so both fail the check.
+    """
+    regressions = 0
+    seen: set[str] = set()
+    for s in statements:
+        seen.add(s.key)
+        old = baseline.get(s.key)
+        if old is None:
+            status = "NEW" if not s.flags else "REGRESSION (new statement)"
+            if s.flags:
+                regressions += 1
+        else:
+            new_flags = [f for f in s.flags if f not in old["flags"]]
+            if new_flags:
+                regressions += 1
+                status = "REGRESSION"
+            elif s.flags != old["flags"]:
+                status = "IMPROVED"
+            elif s.plan != old["plan"]:
+                status = "CHANGED"
+            else:
+                continue
+        print(f"{status}: {s.key}")
+        for line in s.plan:
+            print(f"    {line}")
+        for f in s.flags:
+            print(f"    ! {f}")
+
+    not_run = 0
+    for key in baseline:
+        if key not in seen:
+            not_run += 1
+            print(f"NOT RUN: {key}")
+
+    return regressions, not_run
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks the query plans of the app against the baseline."
+    )
+    _ = parser.add_argument(
+        "--database",
+        default="database.db",
+        help="the seeded database to run the queries against",
+    )
+    _ = parser.add_argument(
+        "--baseline", default=BASELINE, help="the baseline file"
+    )
+    _ = parser.add_argument(
+        "--update",
+        action="store_true",
+        help="write the current query plans as the new baseline",
+    )
+    _ = parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="print the plans of all of the statements",
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        print(f"database not found: {args.database}", file=sys.stderr)
+        sys.exit(2)
+
+    statements = collect(os.path.abspath(args.database))
+
+    if args.verbose:
+        for s in statements:
+            print(s.key)
+            for line in s.plan:
+                print(f"    {line}")
+            for f in s.flags:
+                print(f"    ! {f}")
+
+    if args.update:
+        data = {s.key: {"plan": s.plan, "flags": s.flags} for s in statements}
+        with open(args.baseline, "w") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            _ = f.write("\n")
+        print(f"Wrote {len(data)} statements to {args.baseline}")
+        sys.exit(0)
+
+    baseline: dict[str, dict] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions, not_run = compare(statements, baseline)
+    flagged = sum(1 for s in statements if s.flags)
+    print(
+        f"{len(statements)} statements, {flagged} with flags, "
+        f"{regressions} regressions, {not_run} not run"
+    )
+    sys.exit(1 if regressions > 0 or not_run > 0 else 0)
@@ -2,14 +2,24 @@
 
 # A helper script for generating the database init for the library
 # classification. It prints the SQL output to stdout so you can redirect
-# it as you wish.
-
-from dataclasses import dataclass
-from collections.abc import Sequence
+# it as you wish:
+#
+#     ./scripts/gen_sql_init.py | sqlite3 database.db
+#
+# The script can also load the classification directly into a database,
+# which is a lot faster than running the printed statements:
+#
+#     ./scripts/gen_sql_init.py --database database.db
+
+import argparse
 import os
+import sqlite3
 import sys
+import time
 import xml.etree.ElementTree as ET
-
+from collections.abc import Iterator, Sequence
+from dataclasses import dataclass
+from typing import TypeVar
 
 # The XML namespace (entries that this script needs) of the data.
 NS: dict[str, str] = {
@@ -19,11 +29,22 @@ NS: dict[str, str] = {
 }
 RDF_ABOUT = f"{{{NS['rdf']}}}about"
 RDF_RESOURCE = f"{{{NS['rdf']}}}resource"
+XML_LANG = f"{{{NS['xml']}}}lang"
+
+SKOS_CONCEPT = f"{{{NS['skos']}}}Concept"
+SKOS_CONCEPT_SCHEME = f"{{{NS['skos']}}}ConceptScheme"
+SKOS_HAS_TOP_CONCEPT = f"{{{NS['skos']}}}hasTopConcept"
+SKOS_PREF_LABEL = f"{{{NS['skos']}}}prefLabel"
+SKOS_ALT_LABEL = f"{{{NS['skos']}}}altLabel"
+SKOS_NARROWER = f"{{{NS['skos']}}}narrower"
 
 
 # Prefix of the "Concept" resources this script is interested in.
 RESOURCE_PREFIX = "http://urn.fi/URN:NBN:fi:au:ykl:"
 
+# The number of rows inserted with a single statement.
+BATCH_SIZE = 500
+
 
 @dataclass
 class YKLClass:
@@ -48,119 +69,243 @@ class YKLClass:
     alts: Sequence[str]
 
 
-if __name__ == "__main__":
-    tree: ET.ElementTree
+@dataclass
+class Concept:
+    """
+    Concept is a "Concept" resource as it is read from the data, before
+    the hierarchy is resolved. `narrower` contains the URIs of the
+    subclasses.
+    """
 
-    try:
-        file = os.path.join(
-            os.path.dirname(os.path.realpath(__file__)), "ykl-skos.rdf.xmp"
-        )
-        tree = ET.parse(file)
-    except ET.ParseError as e:
-        print(f"failed to parse ykl-skos.rdf.xmp: {e}", file=sys.stderr)
-        # Use early exits throughout the script. That makes the code
-        # easier to follow.
-        exit(1)
+    uri: str
+    label: str | None
+    alts: Sequence[str]
+    narrower: Sequence[str]
 
-    root = tree.getroot()
 
-    # Find all of the "ConceptSchemes" first. They contain the top-level
-    # resources for finding the top-level YKL classes.
-    concept_scheme = root.find("skos:ConceptScheme", NS)
-    if concept_scheme is None:
-        print("didn't find the concept scheme tag", file=sys.stderr)
-        exit(1)
+@dataclass
+class ClassRow:
+    id: int
+    key: str
+    label: str
+    lft: int
+    rgt: int
+
 
+def read_concepts(file: str) -> tuple[dict[str, Concept], list[str]]:
+    """
+    Reads the concepts from the data in a single pass and indexes them by
+    their URIs. Returns the index and the URIs of the top concepts.
+    """
+    concepts: dict[str, Concept] = {}
     top_concepts: list[str] = []
+    depth = 0
+    for event, elem in ET.iterparse(file, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        # Only the direct children of the root are handled. The nested
+        # elements are read when their parent ends.
+        if depth != 1:
+            continue
+        if elem.tag == SKOS_CONCEPT_SCHEME:
+            for child in elem.iter(SKOS_HAS_TOP_CONCEPT):
+                top_concepts.append(child.attrib[RDF_RESOURCE])
+        elif elem.tag == SKOS_CONCEPT and RDF_ABOUT in elem.attrib:
+            label: str | None = None
+            alts: list[str] = []
+            narrower: list[str] = []
+            for child in elem:
+                if child.tag == SKOS_NARROWER:
+                    narrower.append(child.attrib[RDF_RESOURCE])
+                elif child.attrib.get(XML_LANG) != "fi" or child.text is None:
+                    continue
+                elif child.tag == SKOS_PREF_LABEL and label is None:
+                    label = child.text
+                elif child.tag == SKOS_ALT_LABEL:
+                    alts.append(child.text)
+            uri = elem.attrib[RDF_ABOUT]
+            concepts[uri] = Concept(
+                uri=uri, label=label, alts=alts, narrower=narrower
+            )
+        # The parsed elements are not needed anymore, so they are freed
+        # to keep the memory use flat.
+        elem.clear()
+    return concepts, top_concepts
 
-    for elem in concept_scheme.findall("skos:hasTopConcept", NS):
-        top_concepts.append(elem.attrib[RDF_RESOURCE])
 
-    # Collect the classes into a list. They can then be searched by
-    # using the attributes of the dataclasses.
-    root_classes: list[YKLClass] = []
+def build_tree(
+    concepts: dict[str, Concept], top_concepts: Sequence[str]
+) -> list[YKLClass]:
+    """
+    Resolves the hierarchy of the classes starting from the top
+    concepts. The subclasses are sorted by their keys.
+    """
 
-    def parse(element: ET.Element) -> YKLClass:
-        key = element.attrib[RDF_ABOUT].removeprefix(RESOURCE_PREFIX)
-        pref_label = element.find("skos:prefLabel[@xml:lang='fi']", NS)
-        if pref_label is None or pref_label.text is None:
+    def parse(uri: str) -> YKLClass:
+        concept = concepts.get(uri)
+        if concept is None:
+            print("did not find a concept for", uri, file=sys.stderr)
+            # Use early exits throughout the script. That makes the code
+            # easier to follow.
+            exit(1)
+        key = uri.removeprefix(RESOURCE_PREFIX)
+        if concept.label is None:
             print("did not find a valid prefLabel for", key, file=sys.stderr)
             exit(1)
-        label = pref_label.text
-        alts: list[str] = []
-        for elem in element.findall("skos:altLabel[@xml:lang='fi']", NS):
-            if elem.text is not None:
-                alts.append(elem.text)
-        subclasses: list[YKLClass] = []
-        for elem in element.findall("skos:narrower", NS):
-            child = elem.attrib[RDF_RESOURCE]
-            child_selector = f"skos:Concept[@{RDF_ABOUT}='{child}']"
-            # The elements with this selector should be unique, so it is
-            # safe to use only "find" instead of "findall".
-            child_elem = root.find(child_selector, NS)
-            if child_elem is None:
-                print(
-                    "did not find a child with selector",
-                    child_selector,
-                    file=sys.stderr,
-                )
-                exit(1)
-            child_class = parse(child_elem)
-            subclasses.append(child_class)
-            subclasses.sort(key=lambda c: c.key)
-
-        ykl_class = YKLClass(
-            key=key, subclasses=subclasses, label=label, alts=alts
+        subclasses = [parse(child) for child in concept.narrower]
+        subclasses.sort(key=lambda c: c.key)
+        return YKLClass(
+            key=key,
+            subclasses=subclasses,
+            label=concept.label,
+            alts=concept.alts,
         )
 
-        return ykl_class
+    top = set(top_concepts)
+    # The top-level classes are kept in the order of the data.
+    return [parse(uri) for uri in concepts if uri in top]
 
-    for elem in root.findall("skos:Concept", NS):
-        if RDF_ABOUT in elem.attrib and elem.attrib[RDF_ABOUT] in top_concepts:
-            ykl_class = parse(elem)
-            root_classes.append(ykl_class)
 
-    lines: list[str] = []
-    word_lines: list[str] = []
-
-    # Align the boundaries for the database.
+def number_classes(
+    root_classes: Sequence[YKLClass],
+) -> tuple[list[ClassRow], list[tuple[int, str]]]:
+    """
+    Aligns the nested set boundaries of the classes. Returns the rows for
+    the classification and the index words. The IDs of the classes follow
+    the order of the keys.
+    """
+    boundaries: dict[str, tuple[int, int]] = {}
+    classes: list[YKLClass] = []
 
-    def populate_sql_lines(node: YKLClass, current_lft: int) -> int:
+    def visit(node: YKLClass, current_lft: int) -> int:
         lft = current_lft
         current_lft += 1
-
         for child in node.subclasses:
-            current_lft = populate_sql_lines(child, current_lft)
+            current_lft = visit(child, current_lft)
+        boundaries[node.key] = (lft, current_lft)
+        classes.append(node)
+        return current_lft + 1
+
+    current_lft = 1
+    for ykl_class in root_classes:
+        current_lft = visit(ykl_class, current_lft)
+
+    classes.sort(key=lambda c: c.key)
+    rows: list[ClassRow] = []
+    words: list[tuple[int, str]] = []
+    for id, node in enumerate(classes, start=1):
+        lft, rgt = boundaries[node.key]
+        rows.append(
+            ClassRow(id=id, key=node.key, label=node.label, lft=lft, rgt=rgt)
+        )
+        # The label is also an index word of the class.
+        for word in sorted([node.label, *node.alts]):
+            words.append((id, word))
+    return rows, words
+
+
+T = TypeVar("T")
 
-        rgt = current_lft
-        current_lft += 1
 
-        label = node.label.replace("'", "''")
+def batches(rows: Sequence[T]) -> Iterator[Sequence[T]]:
+    for i in range(0, len(rows), BATCH_SIZE):
+        yield rows[i : i + BATCH_SIZE]
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def print_sql(rows: Sequence[ClassRow], words: Sequence[tuple[int, str]]):
+    # The statements are run in a single transaction and the rows are
+    # inserted in batches, so running the output takes only a moment.
+    lines: list[str] = [
+        "BEGIN;",
+        "DELETE FROM class_index_words;",
+        "DELETE FROM classification;",
+    ]
+    for batch in batches(rows):
+        values = ",\n".join(
+            f"({r.id}, {quote(r.key)}, {quote(r.label)}, {r.lft}, {r.rgt})"
+            for r in batch
+        )
+        lines.append(
+            "INSERT INTO classification (id, key, label, lft, rgt) VALUES\n"
+            f"{values};"
+        )
+    for batch in batches(words):
+        values = ",\n".join(f"({id}, {quote(word)})" for id, word in batch)
         lines.append(
-            f"INSERT INTO classification (key, label, lft, rgt) VALUES ('{node.key}', '{label}', {lft}, {rgt});"
+            f"INSERT INTO class_index_words (class_id, word) VALUES\n{values};"
         )
+    lines.append("COMMIT;")
+    print("\n".join(lines))
 
-        word_lines.append(
-            f"INSERT INTO class_index_words (class_id, word) VALUES ((SELECT id FROM classification WHERE key = '{node.key}'), '{label}');"
+
+def load(
+    database: str, rows: Sequence[ClassRow], words: Sequence[tuple[int, str]]
+):
+    con = sqlite3.connect(database, isolation_level=None)
+    try:
+        _ = con.execute("BEGIN")
+        _ = con.execute("DELETE FROM class_index_words")
+        _ = con.execute("DELETE FROM classification")
+        _ = con.executemany(
+            """
+            INSERT INTO classification (id, key, label, lft, rgt)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            ((r.id, r.key, r.label, r.lft, r.rgt) for r in rows),
         )
-        for word in node.alts:
-            word = word.replace("'", "''")
-            word_lines.append(
-                f"INSERT INTO class_index_words (class_id, word) VALUES ((SELECT id FROM classification WHERE key = '{node.key}'), '{word}');"
-            )
+        _ = con.executemany(
+            "INSERT INTO class_index_words (class_id, word) VALUES (?, ?)",
+            words,
+        )
+        _ = con.execute("COMMIT")
+    finally:
+        con.close()
 
-        return current_lft
 
-    current_lft = 1
-    for ykl_class in root_classes:
-        current_lft = populate_sql_lines(ykl_class, current_lft)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generates the classification for the database."
+    )
+    _ = parser.add_argument(
+        "--database",
+        help="load the classification into this database instead of "
+        + "printing the SQL",
+    )
+    _ = parser.add_argument(
+        "--file",
+        default=os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "ykl-skos.rdf.xmp"
+        ),
+        help="the classification data",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        concepts, top_concepts = read_concepts(args.file)
+    except (ET.ParseError, OSError) as e:
+        print(f"failed to parse {args.file}: {e}", file=sys.stderr)
+        exit(1)
+
+    if not top_concepts:
+        print("didn't find the concept scheme tag", file=sys.stderr)
+        exit(1)
 
-    lines.sort()
-    word_lines.sort()
+    rows, words = number_classes(build_tree(concepts, top_concepts))
 
-    output: str = "DELETE FROM classification;\n\n"
-    sql = "\n".join(lines) + "\n\n"
-    words_sql = "\n".join(word_lines) + "\n"
-    output = f"{output}{sql}{words_sql}"
+    if args.database is None:
+        print_sql(rows, words)
+        exit(0)
 
-    print(output)
+    load(args.database, rows, words)
+    print(
+        f"Loaded {len(rows)} classes and {len(words)} index words in "
+        + f"{time.perf_counter() - start:.1f} s",
+        file=sys.stderr,
+    )
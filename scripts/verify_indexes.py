@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# A helper script for verifying the indexes added by a migration. It runs
+# the requests of check_query_plans.py against a copy of the database
+# with the migration applied, and explains every statement the app issued
+# both with and without the indexes of the migration. The statements
+# whose plans change are printed with both of the plans. The script fails
+# if some of the indexes are not used by any of the statements.
+#
+#     ./scripts/verify_indexes.py \
+#         migrations/010_create_user_access_indexes.sql --database database.db
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from collections.abc import Sequence
+
+import check_query_plans
+
+INDEX_NAME = re.compile(
+    r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)",
+    flags=re.IGNORECASE,
+)
+
+
+def copy_database(source: str, destination: str):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(destination)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def count_scans(plan: Sequence[str]) -> int:
+    return sum(1 for line in plan if line.strip().startswith("SCAN "))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Shows the query plans with and without the indexes of "
+        + "a migration."
+    )
+    _ = parser.add_argument("migration", help="the SQL migration to verify")
+    _ = parser.add_argument(
+        "--database",
+        default="database.db",
+        help="the seeded database to run the queries against",
+    )
+    args = parser.parse_args()
+
+    with open(args.migration) as f:
+        migration_sql = f.read()
+    indexes: list[str] = INDEX_NAME.findall(migration_sql)
+    if not indexes:
+        print(f"no indexes in {args.migration}", file=sys.stderr)
+        sys.exit(2)
+    if not os.path.exists(args.database):
+        print(f"database not found: {args.database}", file=sys.stderr)
+        sys.exit(2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with_indexes = os.path.join(tmp, "with.db")
+        without_indexes = os.path.join(tmp, "without.db")
+        copy_database(os.path.abspath(args.database), with_indexes)
+        copy_database(os.path.abspath(args.database), without_indexes)
+
+        # The indexes are created with IF NOT EXISTS, so the migration can
+        # be run whether it has been applied or not.
+        con = sqlite3.connect(with_indexes)
+        _ = con.executescript(migration_sql)
+        con.close()
+        con = sqlite3.connect(without_indexes)
+        for index in indexes:
+            _ = con.execute(f"DROP INDEX IF EXISTS {index}")
+        con.close()
+
+        statements = check_query_plans.collect(with_indexes)
+
+        con = sqlite3.connect(without_indexes)
+        usage = {index: 0 for index in indexes}
+        changed = 0
+        searched = 0
+        for s in statements:
+            used = [
+                index
+                for index in indexes
+                if any(re.search(rf"\b{index}\b", line) for line in s.plan)
+            ]
+            if not used:
+                continue
+            for index in used:
+                usage[index] += 1
+            try:
+                before = check_query_plans.explain(con, s.example)
+            except sqlite3.Error as e:
+                before = [f"error: {e}"]
+            if before == s.plan:
+                continue
+            changed += 1
+            if count_scans(s.plan) < count_scans(before):
+                searched += 1
+            print(s.key)
+            print("  before:")
+            for line in before:
+                print(f"    {line}")
+            print("  after:")
+            for line in s.plan:
+                print(f"    {line}")
+            print()
+        con.close()
+
+    print(
+        f"{changed} of {len(statements)} statements changed, "
+        + f"{searched} with fewer full scans"
+    )
+    for index, count in usage.items():
+        print(f"{index}: used by {count} statements")
+    sys.exit(1 if any(count == 0 for count in usage.values()) else 0)
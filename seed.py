@@ -1,79 +1,629 @@
 #!/usr/bin/env python3
 
+# Fills the database with generated data for testing and benchmarking.
+# The data is generated from the given RNG seed, so the same arguments
+# always produce the same data set.
+#
+# The popularity of the books follows Zipf's law: a few books are owned,
+# read and reviewed by many of the users while most of the books are
+# owned by no one. The sizes of the libraries have a long tail so that
+# a few users own most of the books.
+#
+# With --bulk the secondary indexes and the triggers are dropped for the
+# duration of the load and the tables maintained by the triggers are
+# rebuilt at the end, which is much faster for the large scales.
+
+import argparse
+import math
 import random
 import sqlite3
+import time
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass
+from itertools import islice
+from typing import TypeVar, cast
 
-USER_COUNT = 10000
-AUTHOR_COUNT = 10**6
-BOOK_PER_AUTHOR_COUNT = 10
-REVIEW_COUNT = 10**5
+import migrator
 
-if __name__ == "__main__":
-    db = sqlite3.connect("database.db")
+T = TypeVar("T")
+
+
+@dataclass
+class Scale:
+    """
+    Scale is the size of the generated data set.
+    """
+
+    users: int
+    authors: int
+    books_per_author: int
+
+
+SCALES: dict[str, Scale] = {
+    "small": Scale(users=100, authors=1000, books_per_author=10),
+    "medium": Scale(users=1000, authors=100000, books_per_author=10),
+    "full": Scale(users=10000, authors=10**6, books_per_author=10),
+}
+
+
+@dataclass
+class Distribution:
+    """
+    Distribution holds the parameters of the generated user activity.
+
+    `popularity_exponent` is the exponent of the Zipf distribution of the
+    popularity of the books. The sizes of the libraries are drawn from a
+    log-normal distribution with the median `library_median` and the
+    shape `library_sigma`, and they are capped at `library_max`.
+    `copy_share` is the share of the owned books that the user has two
+    copies of. `read_share` is the share of the owned books that the user
+    has read, and the users have also read `unowned_reads_median` books
+    they don't own on median. `review_share` is the share of the read
+    books that the user has reviewed.
+    """
+
+    popularity_exponent: float = 1.1
+    library_median: float = 20
+    library_sigma: float = 1.2
+    library_max: int = 5000
+    copy_share: float = 0.05
+    read_share: float = 0.6
+    unowned_reads_median: float = 5
+    review_share: float = 0.2
+
+
+# The weights of the star ratings from one to five.
+STAR_WEIGHTS = (5, 10, 20, 35, 30)
+
+# The reviews are written during the three years before this moment.
+# A fixed moment keeps the data the same between the runs.
+REVIEW_PERIOD_END = 1735689600  # 2025-01-01 00:00:00 UTC
+REVIEW_PERIOD = 3 * 365 * 24 * 60 * 60
+
+
+class Zipf:
+    """
+    Zipf draws book IDs so that the popularity rank r of a book has the
+    probability proportional to 1 / r^s. The ranks are drawn using the
+    inverse of the continuous approximation of the distribution, so a
+    draw takes constant time regardless of the number of the books.
+
+    The ranks are mapped to the IDs with a random affine permutation so
+    that the popular books are spread across the IDs instead of being
+    the first books.
+    """
+
+    def __init__(
+        self, first_id: int, count: int, exponent: float, rng: random.Random
+    ):
+        self.first_id = first_id
+        self.count = count
+        self.exponent = exponent
+        self.step = 1
+        if count > 2:
+            self.step = rng.randrange(1, count)
+            while math.gcd(self.step, count) != 1:
+                self.step = rng.randrange(1, count)
+        self.offset = rng.randrange(count)
+
+    def rank(self, rng: random.Random) -> int:
+        u = rng.random()
+        n = self.count + 1
+        if abs(self.exponent - 1) < 1e-9:
+            x = n**u
+        else:
+            a = 1 - self.exponent
+            x = ((n**a - 1) * u + 1) ** (1 / a)
+        return min(int(x), self.count)
+
+    def draw(self, rng: random.Random) -> int:
+        r = self.rank(rng) - 1
+        return self.first_id + (r * self.step + self.offset) % self.count
+
+    def sample(self, rng: random.Random, k: int) -> list[int]:
+        """
+        Draws k distinct book IDs. Fewer IDs are returned if the draws
+        keep hitting the same popular books.
+        """
+        k = min(k, self.count)
+        result: dict[int, None] = {}
+        attempts = 0
+        while len(result) < k and attempts < 10 * k:
+            result[self.draw(rng)] = None
+            attempts += 1
+        return list(result)
+
+
+# The tables filled by the script. The old rows are deleted in this
+# order so that no row is left referring to a deleted one.
+TABLES = (
+    "reviews",
+    "read_books",
+    "book_ownerships",
+    "libraries",
+    "books",
+    "authors",
+    "users",
+)
+
+
+# books_listing is rebuilt with the rows of the migration that created
+# it, so the bulk load writes the same sort keys as the triggers do and
+# the listings keep their order and cursors.
+_listing = migrator.load_module(
+    next(
+        m
+        for m in migrator.find_migrations()
+        if m.name == "create_books_listing_table"
+    )
+)
+LISTING_COLUMNS = cast(str, _listing.LISTING_COLUMNS)
+LISTING_ROWS = cast(str, _listing.LISTING_ROWS)
+
+
+# The statements for rebuilding the tables that are otherwise kept up to
+# date by the triggers. These are only run in the bulk mode, and only
+# for the tables that exist in the database. books_listing is rebuilt
+# after book_stats as it copies the owned counts from there.
+DERIVED: dict[str, Sequence[str]] = {
+    "book_stats": [
+        "DELETE FROM book_stats",
+        """
+        INSERT INTO book_stats (book_id, owned_count)
+        SELECT book_id, COUNT(id)
+        FROM book_ownerships
+        GROUP BY book_id
+        """,
+    ],
+    "books_listing": [
+        "DELETE FROM books_listing",
+        f"INSERT INTO books_listing ({LISTING_COLUMNS}) {LISTING_ROWS}",
+    ],
+    "book_search": [
+        "DELETE FROM book_search",
+        """
+        INSERT INTO book_search (rowid, name, isbn, author)
+        SELECT
+            b.id,
+            b.name,
+            b.isbn,
+            IFNULL(a.first_name || ' ', '') || a.surname
+        FROM books AS b
+        JOIN authors AS a ON b.author_id = a.id
+        """,
+    ],
+    "class_stats": [
+        "DELETE FROM class_stats",
+        """
+        INSERT INTO class_stats (class_id, book_count)
+        SELECT class_id, COUNT(id)
+        FROM books
+        GROUP BY class_id
+        """,
+    ],
+    "book_ratings": [
+        "DELETE FROM book_ratings",
+        """
+        INSERT INTO book_ratings (
+            book_id,
+            review_count,
+            star_sum,
+            stars_1,
+            stars_2,
+            stars_3,
+            stars_4,
+            stars_5
+        )
+        SELECT
+            book_id,
+            COUNT(id),
+            SUM(stars),
+            SUM(stars = 1),
+            SUM(stars = 2),
+            SUM(stars = 3),
+            SUM(stars = 4),
+            SUM(stars = 5)
+        FROM reviews
+        GROUP BY book_id
+        """,
+    ],
+    # The triggers that bump the versions are dropped for the load, so
+    # the versions are bumped here to drop the results that the running
+    # app has cached.
+    "data_versions": ["UPDATE data_versions SET version = version + 1"],
+    # The "WHERE true" is needed for SQLite to parse the upserts.
+    "book_versions": [
+        """
+        INSERT INTO book_versions (book_id, version)
+        SELECT id, 1 FROM books WHERE true
+        ON CONFLICT (book_id) DO UPDATE SET version = version + 1
+        """
+    ],
+    "user_versions": [
+        """
+        INSERT INTO user_versions (user_id, version)
+        SELECT id, 1 FROM users WHERE true
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1
+        """
+    ],
+}
 
-    _ = db.execute("DELETE FROM users")
 
-    params: list[str] = []
+def batches(rows: Iterable[T], size: int) -> Iterator[list[T]]:
+    it = iter(rows)
+    while batch := list(islice(it, size)):
+        yield batch
 
-    for i in range(1, USER_COUNT + 1):
-        params.append("user" + str(i))
 
+def insert(
+    db: sqlite3.Connection,
+    table: str,
+    sql: str,
+    rows: Iterable[Sequence[str | int]],
+    batch_size: int,
+):
+    """
+    Inserts the rows in batches in a single transaction.
+    """
+    start = time.perf_counter()
+    count = 0
+    _ = db.execute("BEGIN")
+    for batch in batches(rows, batch_size):
+        _ = db.executemany(sql, batch)
+        count += len(batch)
+    _ = db.execute("COMMIT")
+    print(
+        f"Inserted {count} rows into {table} in "
+        f"{time.perf_counter() - start:.1f} s"
+    )
+
+
+def generate_users(scale: Scale) -> Iterator[tuple[str, str]]:
+    for i in range(1, scale.users + 1):
         # NOTE: It is stupid to store the passwords in plain text, but
         # computing the hash in Python for every password while testing
         # here takes way too long. In the actual application the hashes
         # are computed.
-        params.append("pwd" + str(i))
+        yield ("user" + str(i), "pwd" + str(i))
 
-    sql = "INSERT INTO users (username, password_hash) VALUES "
-    values = ["(?, ?)"] * USER_COUNT
-    sql += ", ".join(values)
 
-    _ = db.execute(sql, params)
+def generate_authors(scale: Scale) -> Iterator[tuple[str, str]]:
+    for i in range(1, scale.authors + 1):
+        yield ("first_name_" + str(i), "surname_" + str(i))
 
-    authors: list[tuple[str, str]] = []
 
-    for i in range(1, AUTHOR_COUNT + 1):
-        authors.append(("first_name_" + str(i), "surname_" + str(i)))
+def generate_books(
+    scale: Scale, class_ids: Sequence[int], rng: random.Random
+) -> Iterator[tuple[str, str, int, int]]:
+    for i in range(1, scale.authors + 1):
+        for j in range(1, scale.books_per_author + 1):
+            id = str((i + j) * i * j)
+            yield (id, "book" + id, i, rng.choice(class_ids))
 
-    _ = db.execute("DELETE FROM authors")
 
-    sql = "INSERT INTO authors (first_name, surname) VALUES (?, ?)"
+def insert_activity(
+    db: sqlite3.Connection,
+    distribution: Distribution,
+    seed: int,
+    batch_size: int,
+):
+    """
+    Generates the libraries, the read books and the reviews of the users
+    and inserts them in a single transaction.
+    """
+    start = time.perf_counter()
+    libraries = dict(db.execute("SELECT user_id, id FROM libraries"))
+    first_id, last_id = db.execute(
+        "SELECT MIN(id), MAX(id) FROM books"
+    ).fetchone()
+    if first_id is None:
+        return
 
-    for a in authors:
-        _ = db.execute(sql, [a[0], a[1]])
+    zipf = Zipf(
+        first_id,
+        last_id - first_id + 1,
+        distribution.popularity_exponent,
+        random.Random(seed),
+    )
+    ownerships: list[tuple[int, int]] = []
+    reads: list[tuple[int, int]] = []
+    reviews: list[tuple[int, int, int, str, int, int]] = []
+    counts = {"book_ownerships": 0, "read_books": 0, "reviews": 0}
 
-    _ = db.execute("DELETE FROM books")
+    def flush(force: bool = False):
+        for table, sql, rows in (
+            (
+                "book_ownerships",
+                "INSERT INTO book_ownerships (book_id, library_id) VALUES (?, ?)",
+                ownerships,
+            ),
+            (
+                "read_books",
+                "INSERT INTO read_books (user_id, book_id) VALUES (?, ?)",
+                reads,
+            ),
+            (
+                "reviews",
+                """
+                INSERT INTO reviews (
+                    user_id,
+                    book_id,
+                    stars,
+                    message,
+                    time,
+                    last_edited
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                reviews,
+            ),
+        ):
+            if rows and (force or len(rows) >= batch_size):
+                _ = db.executemany(sql, rows)
+                counts[table] += len(rows)
+                rows.clear()
 
-    sql = "INSERT INTO books (isbn, name, author_id, class_id) VALUES "
-    values = ["(?, ?, ?, ?)"] * BOOK_PER_AUTHOR_COUNT
-    sql += ", ".join(values)
+    _ = db.execute("BEGIN")
+    for user_id, library_id in sorted(libraries.items()):
+        # Every user has a generator of their own so that the activity
+        # of a user does not depend on the other users.
+        rng = random.Random(f"{seed}-{user_id}")
 
-    for i in range(1, AUTHOR_COUNT + 1):
-        params: list[str | int] = []
-        for j in range(1, BOOK_PER_AUTHOR_COUNT + 1):
-            id = str((i + j) * i * j)
-            params.append(id)
-            params.append("book" + id)
-            params.append(i)
-            params.append(random.randint(1, 2000))
-        _ = db.execute(sql, params)
+        size = rng.lognormvariate(
+            math.log(distribution.library_median), distribution.library_sigma
+        )
+        owned = zipf.sample(rng, min(int(size), distribution.library_max))
+        for book_id in owned:
+            ownerships.append((book_id, library_id))
+            if rng.random() < distribution.copy_share:
+                ownerships.append((book_id, library_id))
 
-    _ = db.execute("DELETE FROM reviews")
+        read = [b for b in owned if rng.random() < distribution.read_share]
+        if distribution.unowned_reads_median > 0:
+            extra = rng.lognormvariate(
+                math.log(distribution.unowned_reads_median),
+                distribution.library_sigma,
+            )
+            read_set = set(owned)
+            read += [
+                b for b in zipf.sample(rng, int(extra)) if b not in read_set
+            ]
 
-    sql = """
-        INSERT INTO reviews (
-            user_id,
-            book_id,
-            stars,
-            message,
-            time,
-            last_edited
-        )
-        VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))
+        for book_id in read:
+            reads.append((user_id, book_id))
+            if rng.random() >= distribution.review_share:
+                continue
+            created = REVIEW_PERIOD_END - rng.randrange(REVIEW_PERIOD)
+            edited = created
+            if rng.random() < 0.1:
+                edited = min(
+                    REVIEW_PERIOD_END, created + rng.randrange(REVIEW_PERIOD)
+                )
+            stars = rng.choices(range(1, 6), STAR_WEIGHTS)[0]
+            reviews.append(
+                (
+                    user_id,
+                    book_id,
+                    stars,
+                    f"Arvostelu {stars}/5 käyttäjältä {user_id}",
+                    created,
+                    edited,
+                )
+            )
+        flush()
+    flush(force=True)
+    _ = db.execute("COMMIT")
+
+    for table, count in counts.items():
+        print(f"Inserted {count} rows into {table}")
+    print(f"Generated the activity in {time.perf_counter() - start:.1f} s")
+
+
+def drop_indexes_and_triggers(
+    db: sqlite3.Connection,
+) -> tuple[list[str], list[str]]:
     """
+    Drops the triggers and the secondary indexes of the filled tables and
+    returns the statements for creating the indexes and the triggers
+    again.
+    """
+    placeholders = ", ".join("?" * len(TABLES))
+    rows = db.execute(
+        f"""
+        SELECT type, name, sql
+        FROM sqlite_master
+        WHERE
+            sql IS NOT NULL
+            AND (
+                type = 'trigger'
+                OR (type = 'index' AND tbl_name IN ({placeholders}))
+            )
+        """,
+        TABLES,
+    ).fetchall()
+    for type, name, _ in rows:
+        _ = db.execute(f'DROP {type.upper()} "{name}"')
+    return (
+        [sql for type, _, sql in rows if type == "index"],
+        [sql for type, _, sql in rows if type == "trigger"],
+    )
+
+
+def rebuild_derived(db: sqlite3.Connection):
+    existing = {
+        r[0]
+        for r in db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )
+    }
+    for table, statements in DERIVED.items():
+        if table not in existing:
+            continue
+        start = time.perf_counter()
+        _ = db.execute("BEGIN")
+        for sql in statements:
+            _ = db.execute(sql)
+        _ = db.execute("COMMIT")
+        print(f"Rebuilt {table} in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fills the database with generated test data."
+    )
+    _ = parser.add_argument(
+        "--database", default="database.db", help="the database to fill"
+    )
+    _ = parser.add_argument(
+        "--scale",
+        choices=SCALES.keys(),
+        default="full",
+        help="the size of the data set",
+    )
+    _ = parser.add_argument(
+        "--seed", type=int, default=1, help="the seed for the generated data"
+    )
+    _ = parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="drop the indexes and the triggers for the duration of the load",
+    )
+    _ = parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10000,
+        help="the number of rows inserted at once",
+    )
+    default = Distribution()
+    _ = parser.add_argument(
+        "--popularity-exponent",
+        type=float,
+        default=default.popularity_exponent,
+        help="the exponent of the Zipf distribution of the book popularity",
+    )
+    _ = parser.add_argument(
+        "--library-median",
+        type=float,
+        default=default.library_median,
+        help="the median number of books in a library",
+    )
+    _ = parser.add_argument(
+        "--library-sigma",
+        type=float,
+        default=default.library_sigma,
+        help="the shape of the log-normal distribution of the library sizes",
+    )
+    _ = parser.add_argument(
+        "--library-max",
+        type=int,
+        default=default.library_max,
+        help="the maximum number of books in a library",
+    )
+    _ = parser.add_argument(
+        "--copy-share",
+        type=float,
+        default=default.copy_share,
+        help="the share of the owned books with two copies",
+    )
+    _ = parser.add_argument(
+        "--read-share",
+        type=float,
+        default=default.read_share,
+        help="the share of the owned books that have been read",
+    )
+    _ = parser.add_argument(
+        "--unowned-reads-median",
+        type=float,
+        default=default.unowned_reads_median,
+        help="the median number of books read but not owned by a user",
+    )
+    _ = parser.add_argument(
+        "--review-share",
+        type=float,
+        default=default.review_share,
+        help="the share of the read books that have been reviewed",
+    )
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    distribution = Distribution(
+        popularity_exponent=args.popularity_exponent,
+        library_median=args.library_median,
+        library_sigma=args.library_sigma,
+        library_max=args.library_max,
+        copy_share=args.copy_share,
+        read_share=args.read_share,
+        unowned_reads_median=args.unowned_reads_median,
+        review_share=args.review_share,
+    )
+    rng = random.Random(args.seed)
+
+    # The transactions are managed explicitly.
+    db = sqlite3.connect(args.database, isolation_level=None)
+
+    journal_mode = str(db.execute("PRAGMA journal_mode").fetchone()[0])
+    indexes: list[str] = []
+    triggers: list[str] = []
+    if args.bulk:
+        # The database is thrown away if the load fails, so it doesn't
+        # need to be protected while it is being filled.
+        _ = db.execute("PRAGMA journal_mode = OFF")
+        _ = db.execute("PRAGMA synchronous = OFF")
+        _ = db.execute("PRAGMA locking_mode = EXCLUSIVE")
+        _ = db.execute("PRAGMA temp_store = MEMORY")
+        _ = db.execute("PRAGMA cache_size = -262144")
+        _ = db.execute("PRAGMA foreign_keys = OFF")
+        indexes, triggers = drop_indexes_and_triggers(db)
+
+    _ = db.execute("BEGIN")
+    for table in TABLES:
+        _ = db.execute(f"DELETE FROM {table}")
+    _ = db.execute("COMMIT")
+
+    insert(
+        db,
+        "users",
+        "INSERT INTO users (username, password_hash) VALUES (?, ?)",
+        generate_users(scale),
+        args.batch_size,
+    )
+
+    # Every user gets a library when they register.
+    _ = db.execute("INSERT INTO libraries (user_id) SELECT id FROM users")
+
+    insert(
+        db,
+        "authors",
+        "INSERT INTO authors (first_name, surname) VALUES (?, ?)",
+        generate_authors(scale),
+        args.batch_size,
+    )
+
+    class_ids = [
+        r[0] for r in db.execute("SELECT id FROM classification ORDER BY id")
+    ]
+    if not class_ids:
+        raise SystemExit("the classification is empty, run the migrations")
+    insert(
+        db,
+        "books",
+        "INSERT INTO books (isbn, name, author_id, class_id) VALUES (?, ?, ?, ?)",
+        generate_books(scale, class_ids, rng),
+        args.batch_size,
+    )
+
+    insert_activity(db, distribution, args.seed, args.batch_size)
 
-    for i in range(1, REVIEW_COUNT + 1):
-        _ = db.execute(sql, [1, 1, random.randint(1, 5), "message " + str(i)])
+    if args.bulk:
+        # The indexes are created before rebuilding the tables so that
+        # the rebuilding can use them.
+        start = time.perf_counter()
+        for sql in indexes:
+            _ = db.execute(sql)
+        print(f"Created the indexes in {time.perf_counter() - start:.1f} s")
+        rebuild_derived(db)
+        for sql in triggers:
+            _ = db.execute(sql)
+        _ = db.execute(f"PRAGMA journal_mode = {journal_mode}")
 
-    db.commit()
     db.close()